@@ -1,30 +1,65 @@
 from fastapi import FastAPI, UploadFile, File, Request, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from contextlib import asynccontextmanager
+from collections import defaultdict
 from pathlib import Path
 import json
 from app.database import (
     init_qdrant,
     create_document_collection,
-    reserch_similar_chunks
+    reserch_similar_chunks,
+    warm_up_ollama,
+    close_clients
 )
+from app.config import REDIS_URL
 from app.tasks.tasks_parsing import (
     generate_embedding,
     generate_embedding_batch,
+    batch_chunks_dir,
     celery_app
 )
 from typing import Optional, List, Dict
+from functools import lru_cache
 import logging
 import shutil
 import asyncio
 import json
+import gzip
+import hashlib
+import os
+import time
+import redis.asyncio as aioredis
+
+try:
+    import brotli  # type: ignore
+except Exception:
+    brotli = None
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+
+def _dump_json(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _load_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 logger = logging.getLogger(__name__)
 
 # ----------------- Модели -----------------
 class SearchRequest(BaseModel):
+    """Тело запроса /message; используется только для схемы OpenAPI, разбор идёт через orjson"""
     text: str
 
 # ----------------- WebSocket Manager -----------------
@@ -33,7 +68,9 @@ class ConnectionManager:
     
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
-        self.task_subscriptions: Dict[str, set] = {}
+        self.task_subscriptions: Dict[str, set] = defaultdict(set)
+        # Один монитор на задачу, сколько бы клиентов на неё ни подписалось
+        self.monitoring_tasks: Dict[str, asyncio.Task] = {}
     
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
@@ -43,50 +80,73 @@ class ConnectionManager:
     def disconnect(self, client_id: str):
         if client_id in self.active_connections:
             del self.active_connections[client_id]
-        for task_id in list(self.task_subscriptions.keys()):
-            if client_id in self.task_subscriptions[task_id]:
-                self.task_subscriptions[task_id].discard(client_id)
-                if not self.task_subscriptions[task_id]:
-                    del self.task_subscriptions[task_id]
+        for task_id, subscribers in list(self.task_subscriptions.items()):
+            if client_id in subscribers:
+                subscribers.discard(client_id)
+                if not subscribers:
+                    self._drop_task(task_id)
         logger.info(f"WebSocket клиент отключен: {client_id}")
     
     def subscribe_to_task(self, client_id: str, task_id: str):
-        if task_id not in self.task_subscriptions:
-            self.task_subscriptions[task_id] = set()
         self.task_subscriptions[task_id].add(client_id)
+        if task_id not in self.monitoring_tasks:
+            monitor = asyncio.create_task(monitor_task_status(task_id))
+            self.monitoring_tasks[task_id] = monitor
+            monitor.add_done_callback(lambda done: self._forget_monitor(task_id, done))
         logger.debug(f"Клиент {client_id} подписан на задачу {task_id}")
     
     def unsubscribe_from_task(self, client_id: str, task_id: str):
-        if task_id in self.task_subscriptions:
-            self.task_subscriptions[task_id].discard(client_id)
-            if not self.task_subscriptions[task_id]:
-                del self.task_subscriptions[task_id]
+        subscribers = self.task_subscriptions.get(task_id)
+        if subscribers is not None:
+            subscribers.discard(client_id)
+            if not subscribers:
+                self._drop_task(task_id)
+
+    def _drop_task(self, task_id: str):
+        """Подписчиков не осталось: монитор задачи больше не нужен"""
+        del self.task_subscriptions[task_id]
+        monitor = self.monitoring_tasks.pop(task_id, None)
+        if monitor is not None:
+            monitor.cancel()
+
+    def _forget_monitor(self, task_id: str, monitor: asyncio.Task):
+        # Монитор мог быть уже заменён новым после повторной подписки
+        if self.monitoring_tasks.get(task_id) is monitor:
+            del self.monitoring_tasks[task_id]
     
+    async def _send_to_clients(self, client_ids: List[str], message: dict) -> List[str]:
+        """
+        Сообщение сериализуется один раз и отправляется всем клиентам параллельно.
+        Возвращает клиентов, отправка которым не удалась
+        """
+        # Текстовый кадр, как у send_json: браузер разбирает его через JSON.parse
+        payload = _dump_json(message).decode("utf-8")
+        client_ids = [c for c in client_ids if c in self.active_connections]
+        results = await asyncio.gather(
+            *(self.active_connections[c].send_text(payload) for c in client_ids),
+            return_exceptions=True
+        )
+        failed = []
+        for client_id, result in zip(client_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка отправки клиенту {client_id}: {result}")
+                failed.append(client_id)
+        return failed
+
     async def send_task_update(self, task_id: str, data: dict):
         """Отправка обновления всем подписанным клиентам"""
-        if task_id not in self.task_subscriptions:
+        subscribers = self.task_subscriptions.get(task_id)
+        if not subscribers:
             return
         
-        disconnected_clients = []
-        for client_id in self.task_subscriptions[task_id]:
-            if client_id in self.active_connections:
-                try:
-                    await self.active_connections[client_id].send_json(data)
-                except Exception as e:
-                    logger.error(f"Ошибка отправки клиенту {client_id}: {e}")
-                    disconnected_clients.append(client_id)
+        disconnected_clients = await self._send_to_clients(list(subscribers), data)
         
         for client_id in disconnected_clients:
             self.disconnect(client_id)
     
     async def broadcast(self, message: dict):
         """Рассылка всем подключенным клиентам"""
-        disconnected = []
-        for client_id, connection in self.active_connections.items():
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(client_id)
+        disconnected = await self._send_to_clients(list(self.active_connections), message)
         
         for client_id in disconnected:
             self.disconnect(client_id)
@@ -96,11 +156,12 @@ manager = ConnectionManager()
 # ----------------- Вспомогательные функции -----------------
 async def cleanup_tasks_and_files(task_ids: List[str], file_paths: List[str]):
     """Отмена задач Celery и удаление файлов"""
-    for t in task_ids:
+    if task_ids:
+        # Одна широковещательная команда revoke на все задачи вместо отдельной на каждую
         try:
-            celery_app.control.revoke(t, terminate=True, signal='SIGKILL')
+            celery_app.control.revoke(list(task_ids), terminate=True, signal='SIGKILL')
         except Exception as e:
-            logger.warning(f"Ошибка отмены задачи {t}: {str(e)}")
+            logger.warning(f"Ошибка отмены задач {task_ids}: {str(e)}")
     for f in file_paths:
         try:
             Path(f).unlink()
@@ -111,87 +172,351 @@ async def cleanup_tasks_and_files(task_ids: List[str], file_paths: List[str]):
             logger.warning(f"Ошибка удаления файла {f}: {str(e)}")
 
 
-async def normalize_error(raw) -> dict:
-    if isinstance(raw, dict) and 'exc_type' in raw:
-        return {'type': raw['exc_type'],
-                'message': str(raw.get('exc_message') or raw.get('exc_args', ''))}
-    if isinstance(raw, dict) and 'type' in raw:
-        return raw
-    if isinstance(raw, BaseException):
+def normalize_error(raw) -> dict:
+    if isinstance(raw, dict):
+        exc_type = raw.get('exc_type')
+        if exc_type:
+            return {'type': exc_type,
+                    'message': str(raw.get('exc_message') or raw.get('exc_args', ''))}
+        if 'type' in raw:
+            return raw
+    elif isinstance(raw, BaseException):
         return {'type': type(raw).__name__, 'message': str(raw)}
     return {'type': 'Exception',
             'message': str(raw) if raw else 'Unknown error'}
 
+UPLOADS_DIR = Path("uploads")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Предельное время сохранения одного файла, сек
+UPLOAD_TIMEOUT = 60
+# Сколько загруженных файлов одновременно копируется на диск
+UPLOAD_CONCURRENCY = 4
+_upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+
+def _check_deadline(deadline: float) -> None:
+    if time.monotonic() > deadline:
+        raise TimeoutError("Upload timeout")
+
+
+def _sendfile_upload(src_fd: int, dst_fd: int, size: int, deadline: float) -> int:
+    """
+    Копирование файла внутри ядра через sendfile: байты не проходят через Python.
+    Возвращает число скопированных байт; если sendfile не поддерживается для этих файлов,
+    копирование останавливается, и остаток докопирует вызывающий
+    """
+    offset = 0
+    while offset < size:
+        _check_deadline(deadline)
+        try:
+            sent = os.sendfile(dst_fd, src_fd, offset, min(size - offset, UPLOAD_CHUNK_SIZE))
+        except OSError as e:
+            logger.debug(f"sendfile недоступен ({e}), копирование по кускам")
+            break
+        if sent == 0:
+            break
+        offset += sent
+    return offset
+
+
+def _copy_upload(src, save_path: Path, deadline: float) -> int:
+    """
+    Копирование загрузки в файл. Срок проверяется между кусками в самом потоке:
+    отменить to_thread снаружи нельзя, и поток продолжал бы писать уже после таймаута
+    """
+    src.seek(0)
+    size = 0
+    expected = None
+    with open(save_path, "wb") as dst:
+        # fileno() у SpooledTemporaryFile сам сбрасывает спул на диск: небольшие загрузки,
+        # ещё лежащие в памяти, копируются по кускам, а sendfile - только для уже сброшенных
+        if hasattr(os, "sendfile") and getattr(src, "_rolled", False):
+            try:
+                src_fd = src.fileno()
+            except (OSError, ValueError):
+                src_fd = None
+            if src_fd is not None:
+                expected = os.fstat(src_fd).st_size
+                size = _sendfile_upload(src_fd, dst.fileno(), expected, deadline)
+                if size == expected:
+                    return size
+                # sendfile не сдвигает позиции файловых объектов: остаток копируется с места остановки
+                src.seek(size)
+                dst.seek(size)
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            _check_deadline(deadline)
+            dst.write(chunk)
+            size += len(chunk)
+    if expected is not None and size < expected:
+        raise OSError(f"Загрузка скопирована не полностью: {size} из {expected} байт")
+    return size
+
+
+def make_upload_dirs(dirs: set) -> None:
+    """Создаёт каталоги загрузки: по одному mkdir на уникальный каталог, а не на каждый файл"""
+    for directory in dirs:
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+async def save_upload(upload: UploadFile, save_path: Path, timeout: float = UPLOAD_TIMEOUT,
+                      request: Optional[Request] = None) -> int:
+    """
+    Потоковое сохранение загруженного файла на диск кусками по UPLOAD_CHUNK_SIZE:
+    файл целиком в памяти не собирается. Возвращает размер файла.
+    Каталог файла должен уже существовать (см. make_upload_dirs).
+    Если копирование не уложилось в timeout секунд, поток копирования
+    завершается с TimeoutError, и только после этого освобождается слот семафора.
+    Если передан request, отключение клиента проверяется после получения слота,
+    прямо перед копированием, и сохранение прерывается с ConnectionAbortedError
+    """
+    async with _upload_semaphore:
+        if request is not None and await request.is_disconnected():
+            raise ConnectionAbortedError("Client disconnected")
+        # Срок отсчитывается с получения слота: ожидание в очереди семафора в timeout не входит
+        deadline = time.monotonic() + timeout
+        return await asyncio.to_thread(_copy_upload, upload.file, save_path, deadline)
+
+
+@lru_cache(maxsize=4)
+def load_page(path: str) -> Dict[str, bytes]:
+    """
+    HTML-страница читается и сжимается один раз на процесс.
+    Возвращает {Content-Encoding: тело}; если файла нет, FileNotFoundError
+    не кэшируется, и появившаяся позже страница будет прочитана
+    """
+    body = Path(path).read_bytes()
+    variants = {"identity": body, "gzip": gzip.compress(body, 6)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=5)
+    return variants
+
+
+@lru_cache(maxsize=4)
+def page_etag(path: str) -> str:
+    """Слабый ETag по содержимому страницы: одинаков для всех вариантов сжатия"""
+    return f'W/"{hashlib.blake2b(load_page(path)["identity"], digest_size=8).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Проверка If-None-Match по RFC 9110: заголовок может перечислять несколько ETag
+    через запятую или быть "*"; сравнение слабое, префикс W/ не учитывается
+    """
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Разбор Accept-Encoding в {кодировка: q}; кодировки с q=0 клиент явно отклоняет"""
+    accepted = {}
+    for token in accept_encoding.split(","):
+        name, _, params = token.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def page_response(request: Request, path: str) -> Response:
+    """Отдаёт заранее сжатую страницу в лучшей кодировке из Accept-Encoding: br > gzip > без сжатия"""
+    try:
+        variants = load_page(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Браузер перепроверяет страницу при каждом открытии, но неизменённую не скачивает заново
+    headers = {"Vary": "Accept-Encoding", "ETag": page_etag(path), "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    wildcard_q = accepted.get("*", 0.0)
+    best_encoding, best_q = None, 0.0
+    # При равном q предпочтение у br
+    for encoding in ("br", "gzip"):
+        q = accepted.get(encoding, wildcard_q)
+        if encoding in variants and q > best_q:
+            best_encoding, best_q = encoding, q
+    if best_encoding is not None:
+        return Response(
+            variants[best_encoding],
+            media_type="text/html",
+            headers={**headers, "Content-Encoding": best_encoding}
+        )
+    return Response(variants["identity"], media_type="text/html", headers=headers)
+
+# ----------------- Redis -----------------
+# Общий пул соединений процесса: мониторы задач обращаются к Redis параллельно,
+# не дожидаясь друг друга на одном сокете и не блокируя event loop.
+# Когда все соединения заняты, запрос ждёт свободное до REDIS_POOL_TIMEOUT секунд, а не падает
+REDIS_MAX_CONNECTIONS = 32
+REDIS_POOL_TIMEOUT = 20
+_redis: Optional[aioredis.Redis] = None
+# Подписка pub/sub держит соединение всё время мониторинга задачи, поэтому
+# такие соединения берутся из отдельного клиента и не занимают общий пул
+_pubsub_redis: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = aioredis.Redis(
+            connection_pool=aioredis.BlockingConnectionPool.from_url(
+                REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT
+            )
+        )
+    return _redis
+
+
+def get_pubsub_redis() -> aioredis.Redis:
+    global _pubsub_redis
+    if _pubsub_redis is None:
+        _pubsub_redis = aioredis.Redis.from_url(REDIS_URL)
+    return _pubsub_redis
+
+
+async def close_redis():
+    global _redis, _pubsub_redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+    if _pubsub_redis is not None:
+        await _pubsub_redis.aclose()
+        _pubsub_redis = None
+
+
+async def get_task_meta(task_id: str) -> dict:
+    """
+    Метаданные задачи из result backend Celery одним асинхронным GET:
+    статус и info/result читаются вместе, а не отдельными запросами AsyncResult.state и .info
+    """
+    backend = celery_app.backend
+    raw = await get_redis().get(backend.get_key_for_task(task_id))
+    if raw is None:
+        return {"status": "PENDING", "result": None}
+    return backend.decode_result(raw)
+
 # ----------------- Background task для мониторинга задач -----------------
+# Если за это время не пришло ни одного уведомления, статус перечитывается из Redis:
+# страховка от пропущенного сообщения pub/sub
+MONITOR_RESYNC_INTERVAL = 30
+
+
+def build_task_update(task_id: str, meta: dict) -> tuple:
+    """Сообщение для WebSocket по метаданным задачи; второй элемент - задача завершена"""
+    state = meta["status"]
+    data = {"task_id": task_id, "type": "task_update"}
+
+    if state == 'PENDING':
+        data.update({
+            "status": "pending",
+            "progress": 0,
+            "message": "Задача в очереди..."
+        })
+    elif state == 'PROGRESS':
+        info = meta.get("result") or {}
+        data.update({
+            "status": "processing",
+            "progress": info.get('progress', 0),
+            "current_step": info.get('current_step', 0),
+            "total_steps": info.get('total_steps', 6),
+            "message": info.get('status', 'Обработка...'),
+            "filename": info.get('filename', '')
+        })
+    elif state == 'SUCCESS':
+        data.update({
+            "status": "completed",
+            "progress": 100,
+            "result": meta.get("result") or {},
+            "message": "Обработка завершена"
+        })
+        return data, True
+    elif state == 'FAILURE':
+        data.update({
+            "status": "failed",
+            "error": normalize_error(meta.get("result") or {}),
+            "message": "Ошибка обработки"
+        })
+        return data, True
+    elif state == 'REVOKED':
+        data.update({
+            "status": "cancelled",
+            "message": "Задача отменена"
+        })
+        return data, True
+
+    return data, False
+
+
 async def monitor_task_status(task_id: str):
-    """Фоновый мониторинг статуса задачи и отправка обновлений через WebSocket"""
+    """
+    Фоновый мониторинг статуса задачи и отправка обновлений через WebSocket.
+    Result backend Celery на Redis публикует каждое сохранение статуса в канал с именем
+    ключа задачи, поэтому монитор подписывается на него и просыпается только при изменениях
+    """
+    backend = celery_app.backend
+    pubsub = get_pubsub_redis().pubsub()
     try:
+        # Подписка оформляется до первого чтения, чтобы не потерять обновление между ними
+        await pubsub.subscribe(backend.get_key_for_task(task_id))
+        meta = await get_task_meta(task_id)
+        last_sent = None
+
         while True:
-            task = celery_app.AsyncResult(task_id)
-            state = task.state
-            
-            data = {"task_id": task_id, "type": "task_update"}
-            
-            if state == 'PENDING':
-                data.update({
-                    "status": "pending",
-                    "progress": 0,
-                    "message": "Задача в очереди..."
-                })
-            elif state == 'PROGRESS':
-                info = task.info or {}
-                data.update({
-                    "status": "processing",
-                    "progress": info.get('progress', 0),
-                    "current_step": info.get('current_step', 0),
-                    "total_steps": info.get('total_steps', 6),
-                    "message": info.get('status', 'Обработка...'),
-                    "filename": info.get('filename', '')
-                })
-            elif state == 'SUCCESS':
-                result_data = task.result or {}
-                data.update({
-                    "status": "completed",
-                    "progress": 100,
-                    "result": result_data,
-                    "message": "Обработка завершена"
-                })
-                await manager.send_task_update(task_id, data)
-                break
-            elif state == 'FAILURE':
-                info = await normalize_error(task.info or {})
-                data.update({
-                    "status": "failed",
-                    "error": info,
-                    "message": "Ошибка обработки"
-                })
+            data, finished = build_task_update(task_id, meta)
+            # Периодическая сверка обычно возвращает тот же статус: клиенту уходят только изменения
+            if data != last_sent:
                 await manager.send_task_update(task_id, data)
+                last_sent = data
+            if finished:
                 break
-            elif state == 'REVOKED':
-                data.update({
-                    "status": "cancelled",
-                    "message": "Задача отменена"
-                })
-                await manager.send_task_update(task_id, data)
-                break
-            
-            await manager.send_task_update(task_id, data)
-            await asyncio.sleep(1)
-            
+
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=MONITOR_RESYNC_INTERVAL
+            )
+            if message is None:
+                meta = await get_task_meta(task_id)
+            else:
+                meta = backend.decode_result(message["data"])
+
     except Exception as e:
         logger.error(f"Ошибка мониторинга задачи {task_id}: {e}")
+    finally:
+        await pubsub.aclose()
 
 # ----------------- Lifespan -----------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    UPLOADS_DIR.mkdir(exist_ok=True)
     init_qdrant()
     create_document_collection()
+    await asyncio.to_thread(warm_up_ollama)
     logger.info("✅ FastAPI startup completed")
     yield
+    await close_redis()
+    close_clients()
     logger.info("🛑 FastAPI shutdown")
 
 # ----------------- Инициализация FastAPI -----------------
-app = FastAPI(lifespan=lifespan)
+# JSON-ответы (в том числе результаты поиска с длинными текстами) сериализуются через orjson, если он установлен
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse
+)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 # ----------------- Middleware для оптимизации соединений -----------------
@@ -200,15 +525,19 @@ async def optimize_connection_headers(request: Request, call_next):
     """Оптимизированные заголовки для HTTP соединений"""
     response = await call_next(request)
     
+    # Остальные ответы не закрывают соединение: HTTP/1.1 keep-alive uvicorn по умолчанию
+    # избавляет /message и загрузки от нового TCP-рукопожатия на каждый запрос
     if request.url.path.startswith("/ws") or request.url.path.startswith("/task-status"):
         response.headers["Connection"] = "keep-alive"
         response.headers["Keep-Alive"] = "timeout=60, max=1000"
-    else:
-        response.headers["Connection"] = "close"
     
     return response
 
 # ----------------- WebSocket эндпоинт -----------------
+# Ответ на ping не меняется - сериализуется один раз
+PONG_FRAME = '{"type":"pong"}'
+
+
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     """WebSocket соединение для real-time обновлений статуса задач"""
@@ -217,20 +546,20 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
     try:
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = _load_json(data)
+            message_type = message.get("type")
             
-            if message.get("type") == "subscribe":
+            if message_type == "subscribe":
                 task_id = message.get("task_id")
                 if task_id:
                     manager.subscribe_to_task(client_id, task_id)
-                    asyncio.create_task(monitor_task_status(task_id))
                     await websocket.send_json({
                         "type": "subscribed",
                         "task_id": task_id,
                         "message": f"Подписка на задачу {task_id} активна"
                     })
             
-            elif message.get("type") == "unsubscribe":
+            elif message_type == "unsubscribe":
                 task_id = message.get("task_id")
                 if task_id:
                     manager.unsubscribe_from_task(client_id, task_id)
@@ -239,8 +568,8 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                         "task_id": task_id
                     })
             
-            elif message.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+            elif message_type == "ping":
+                await websocket.send_text(PONG_FRAME)
                 
     except WebSocketDisconnect:
         manager.disconnect(client_id)
@@ -265,25 +594,27 @@ async def root():
     }
 
 @app.get("/semantic", response_class=HTMLResponse)
-async def css_styles():
-    path = Path("server/semantic.html")
-    if not path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    return path.read_text(encoding="utf-8")
+async def css_styles(request: Request):
+    return page_response(request, "server/semantic.html")
 
 @app.get("/index", response_class=HTMLResponse)
-async def index():
-    path = Path("server/index.html")
-    if not path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    return path.read_text(encoding="utf-8")
+async def index(request: Request):
+    return page_response(request, "server/index.html")
 
 # ----------------- Управление задачами Celery -----------------
+async def drop_batch_chunks(task_id: str) -> None:
+    """
+    Удаление каталога чанков пакета: оставшиеся подзадачи пакета пропускают свои файлы,
+    а уже сохранённые чанки не остаются на диске после отмены
+    """
+    await asyncio.to_thread(shutil.rmtree, batch_chunks_dir(task_id), True)
+
 @app.delete("/task-cancel/{task_id}")
 async def cancel_task(task_id: str):
     """Отмена задачи Celery по ID"""
     try:
         celery_app.control.revoke(task_id, terminate=True, signal='SIGKILL')
+        await drop_batch_chunks(task_id)
         logger.info(f"Task {task_id} cancelled")
         
         await manager.send_task_update(task_id, {
@@ -304,6 +635,7 @@ async def cancel_tasks_batch(task_ids: List[str]):
     for task_id in task_ids:
         try:
             celery_app.control.revoke(task_id, terminate=True, signal='SIGKILL')
+            await drop_batch_chunks(task_id)
             cancelled.append(task_id)
             logger.info(f"Задача {task_id} отменена")
             
@@ -336,63 +668,67 @@ async def get_active_tasks():
     return {"active_tasks": tasks_list, "count": len(tasks_list)}
 
 # ----------------- Загрузка файлов -----------------
+def enqueue_embeddings(filenames: List[str], task_ids: List[str]) -> None:
+    """
+    Публикует generate_embedding для каждого файла через одного producer'а:
+    соединение и канал брокера берутся из пула один раз на всю загрузку.
+    id задач дописываются в task_ids по мере публикации, чтобы при сбое их можно было отменить
+    """
+    with celery_app.producer_or_acquire() as producer:
+        for filename in filenames:
+            task_ids.append(generate_embedding.apply_async(args=[filename], producer=producer).id)
+
+
 @app.post("/select-file")
 async def select_file(request: Request, file: List[UploadFile] = File(...)):
-    task_ids, uploaded_files, total_size, created_file_paths = [], [], 0, []
+    task_ids, created_file_paths = [], []
 
-    try:
-        for f in file:
-            if await request.is_disconnected():
-                await cleanup_tasks_and_files(task_ids, created_file_paths)
+    async def upload_one(f: UploadFile) -> dict:
+        try:
+            save_path = UPLOADS_DIR / f.filename
+            created_file_paths.append(str(save_path))
+
+            try:
+                file_size = await save_upload(f, save_path, request=request)
+            except ConnectionAbortedError:
                 logger.warning("Client disconnected during upload")
                 raise HTTPException(status_code=499, detail="Client disconnected")
+            except TimeoutError:
+                raise HTTPException(status_code=408, detail="Upload timeout")
 
-            try:
-                contents = bytearray()
-                chunk_size = 1024 * 1024
-                
-                try:
-                    async with asyncio.timeout(60):
-                        while chunk := await f.read(chunk_size):
-                            if await request.is_disconnected():
-                                await cleanup_tasks_and_files(task_ids, created_file_paths)
-                                raise HTTPException(status_code=499, detail="Client disconnected")
-                            contents.extend(chunk)
-                except asyncio.TimeoutError:
-                    await cleanup_tasks_and_files(task_ids, created_file_paths)
-                    raise HTTPException(status_code=408, detail="Upload timeout")
-
-                file_size = len(contents)
-                total_size += file_size
-                uploads_dir = Path("uploads")
-                uploads_dir.mkdir(exist_ok=True)
-                save_path = uploads_dir / f.filename
-                save_path.write_bytes(contents)
-                created_file_paths.append(str(save_path))
-
-                task = generate_embedding.delay(f.filename)
-                task_ids.append(task.id)
-                
-                uploaded_files.append({
-                    "filename": f.filename,
-                    "size": file_size,
-                    "content_type": f.content_type,
-                    "task_id": task.id
-                })
-                logger.info(f"Создана задача {task.id} для файла {f.filename}")
+            return {
+                "filename": f.filename,
+                "size": file_size,
+                "content_type": f.content_type
+            }
+        finally:
+            await f.close()
 
-            finally:
-                await f.close()
+    try:
+        await asyncio.to_thread(make_upload_dirs, {(UPLOADS_DIR / f.filename).parent for f in file})
+        # Файлы сохраняются параллельно (диск ограничен UPLOAD_CONCURRENCY);
+        # ошибки собираются после завершения всех загрузок, чтобы очистка не гонялась с ними
+        results = await asyncio.gather(*(upload_one(f) for f in file), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+
+        # Все задачи публикуются одним вызовом вне event loop
+        await asyncio.to_thread(enqueue_embeddings, [r["filename"] for r in results], task_ids)
+        for r, task_id in zip(results, task_ids):
+            r["task_id"] = task_id
+            logger.info(f"Создана задача {task_id} для файла {r['filename']}")
 
         return {
             "status": "accepted",
             "message": f"Принято {len(file)} файл(ов) в обработку",
-            "files": uploaded_files,
-            "task_ids": task_ids,
-            "total_size": total_size,
+            "files": results,
+            "task_ids": [r["task_id"] for r in results],
+            "total_size": sum(r["size"] for r in results),
             "count": len(file)
         }
     except HTTPException:
+        await cleanup_tasks_and_files(task_ids, created_file_paths)
         raise
     except Exception as e:
         await cleanup_tasks_and_files(task_ids, created_file_paths)
@@ -401,53 +737,54 @@ async def select_file(request: Request, file: List[UploadFile] = File(...)):
 
 @app.post("/select-folder")
 async def select_folder(request: Request, file: List[UploadFile] = File(...), folder_name: Optional[str] = None):
-    uploaded_files, file_paths, total_size = [], [], 0
-    uploads_dir = Path("uploads")
-    uploads_dir.mkdir(exist_ok=True)
+    file_paths = []
 
     if not folder_name and file:
         folder_name = file[0].filename.split("/")[0] if "/" in file[0].filename else "uploaded_folder"
-    folder_path = uploads_dir / folder_name
-    folder_path.mkdir(parents=True, exist_ok=True)
+    # folder_name - только подпись пакета: файлы лежат там, куда указывают их имена,
+    # и пакетная задача получает именно эти пути
+    top_dirs = {UPLOADS_DIR / Path(f.filename).parts[0] for f in file if len(Path(f.filename).parts) > 1}
+    await asyncio.to_thread(make_upload_dirs, {(UPLOADS_DIR / f.filename).parent for f in file})
     logger.info(f"Начало загрузки папки: {folder_name}, файлов: {len(file)}")
 
-    try:
-        for f in file:
-            if await request.is_disconnected():
-                await cleanup_tasks_and_files([], file_paths)
-                if folder_path.exists() and folder_path.is_dir():
-                    shutil.rmtree(folder_path)
+    async def upload_one(f: UploadFile) -> dict:
+        try:
+            save_path = UPLOADS_DIR / f.filename
+            file_paths.append(str(save_path))
+
+            try:
+                file_size = await save_upload(f, save_path, request=request)
+            except ConnectionAbortedError:
                 logger.warning("Client disconnected during folder upload")
                 raise HTTPException(status_code=499, detail="Client disconnected")
+            except TimeoutError:
+                raise HTTPException(status_code=408, detail="Upload timeout")
 
-            try:
-                try:
-                    async with asyncio.timeout(60):
-                        contents: bytes = await f.read()
-                except asyncio.TimeoutError:
-                    await cleanup_tasks_and_files([], file_paths)
-                    raise HTTPException(status_code=408, detail="Upload timeout")
-                
-                file_size = len(contents)
-                total_size += file_size
-
-                save_path = uploads_dir / f.filename
-                save_path.parent.mkdir(parents=True, exist_ok=True)
-                save_path.write_bytes(contents)
-
-                file_paths.append(str(save_path))
-                uploaded_files.append({
-                    "filename": f.filename,
-                    "size": file_size,
-                    "content_type": f.content_type,
-                    "file_path": str(save_path),
-                    "relative_path": f.filename
-                })
-                logger.info(f"Сохранен файл: {save_path}")
-            finally:
-                await f.close()
-
-        task = generate_embedding_batch.delay(file_paths, folder_name)
+            logger.info(f"Сохранен файл: {save_path}")
+            return {
+                "filename": f.filename,
+                "size": file_size,
+                "content_type": f.content_type,
+                "file_path": str(save_path),
+                "relative_path": f.filename
+            }
+        finally:
+            await f.close()
+
+    try:
+        # Файлы папки сохраняются параллельно (диск ограничен UPLOAD_CONCURRENCY);
+        # пакетная задача ставится одна, после сохранения всех файлов
+        uploaded_files = await asyncio.gather(*(upload_one(f) for f in file), return_exceptions=True)
+        errors = [r for r in uploaded_files if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        total_size = sum(r["size"] for r in uploaded_files)
+
+        task = await asyncio.to_thread(
+            generate_embedding_batch.delay,
+            folder_name,
+            [r["file_path"] for r in uploaded_files]
+        )
         logger.info(f"Создана пакетная задача {task.id} для папки {folder_name}")
         return {
             "status": "accepted",
@@ -460,7 +797,11 @@ async def select_folder(request: Request, file: List[UploadFile] = File(...), fo
             "mode": "batch"
         }
 
-    except HTTPException:
+    except HTTPException as e:
+        await cleanup_tasks_and_files([], file_paths)
+        if e.status_code == 499:
+            for top_dir in top_dirs:
+                shutil.rmtree(top_dir, ignore_errors=True)
         raise
     except Exception as e:
         await cleanup_tasks_and_files([], file_paths)
@@ -468,36 +809,101 @@ async def select_folder(request: Request, file: List[UploadFile] = File(...), fo
         raise HTTPException(status_code=500, detail=str(e))
 
 # ----------------- Семантический поиск -----------------
-@app.post("/message")
-async def message_input(request: SearchRequest):
+UNKNOWN_VALUE = 'Неизвестно'
+
+
+def format_search_result(rank: int, result: dict) -> dict:
+    """Результат поиска в формате ответа /message; метаданные читаются один раз"""
+    metadata = result.get('metadata') or {}
+    return {
+        "rank": rank,
+        "id": result.get('id', f'result_{rank}'),
+        "score": result['score'] * 100,
+        "text": result['text'],
+        "file_name": metadata.get('file_name', UNKNOWN_VALUE),
+        "file_path": metadata.get('file_path', UNKNOWN_VALUE),
+        "file_extension": metadata.get('file_extension', UNKNOWN_VALUE),
+        "chunk_index": metadata.get('chunk_index', 0)
+    }
+
+def stream_search_results(search_result: list, top_k: int = 5):
+    """
+    Ответ /message отдаётся по частям: заголовок уходит клиенту сразу,
+    каждый результат форматируется и сериализуется непосредственно перед отправкой.
+    Собранный поток - обычный JSON-документ того же формата, что и раньше.
+    Статус ответа уже отправлен, поэтому ошибка форматирования не прерывает поток:
+    массив закрывается, а описание ошибки попадает в поле error
+    """
+    top_results = search_result[:top_k]
+    header = _dump_json({
+        "status": "success",
+        "message": f"Найдено результатов: {len(search_result)}",
+        "count": len(top_results)
+    })
+    # Открываем объект заново, дописывая в него массив results
+    yield header[:-1] + b',"results":['
+    for i, result in enumerate(top_results, 1):
+        try:
+            item = _dump_json(format_search_result(i, result))
+        except Exception as e:
+            logger.exception("Ошибка форматирования результата поиска")
+            yield b'],"error":' + _dump_json(f"Ошибка при формировании результатов: {str(e)}") + b'}'
+            return
+        yield item if i == 1 else b',' + item
+    yield b']}'
+
+
+def _parse_search_text(body: bytes) -> str:
+    """
+    Текст запроса из тела /message. Некорректное тело отклоняется с RequestValidationError:
+    клиент получает 422 с тем же списком ошибок в detail, что и при валидации через SearchRequest
+    """
+    if not body:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        payload = _load_json(body)
+    except ValueError as e:
+        raise RequestValidationError([{
+            "type": "json_invalid", "loc": ("body",), "msg": "JSON decode error", "input": {},
+            "ctx": {"error": str(e)}
+        }])
+    text = payload.get("text") if isinstance(payload, dict) else None
+    if isinstance(text, str):
+        return text
+    # Медленный путь только для ошибок: формулировки берутся у самой модели
+    try:
+        SearchRequest.model_validate(payload)
+    except ValidationError as e:
+        raise RequestValidationError([
+            {"type": err["type"], "loc": ("body", *err["loc"]), "msg": err["msg"], "input": err["input"]}
+            for err in e.errors()
+        ])
+    raise RequestValidationError([{"type": "string_type", "loc": ("body", "text"),
+                                   "msg": "Input should be a valid string", "input": text}])
+
+
+@app.post(
+    "/message",
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": SearchRequest.model_json_schema()}}
+    }}
+)
+async def message_input(request: Request):
     """Поиск по семантическому запросу"""
-    if not request.text or not request.text.strip():
+    # Тело разбирается напрямую через orjson: модель pydantic здесь не нужна ради одного поля
+    text = _parse_search_text(await request.body())
+    if not text.strip():
         return {"status": "error", "message": "Текст запроса не может быть пустым", "results": []}
 
     try:
-        search_result = reserch_similar_chunks(request.text)
+        # Эмбеддинг запроса и поиск в Qdrant блокирующие - выполняем в пуле потоков,
+        # чтобы не останавливать event loop (WebSocket-статусы, загрузки)
+        search_result = await asyncio.to_thread(reserch_similar_chunks, text)
         if not search_result:
             return {"status": "no_results", "message": "По вашему запросу ничего не найдено", "results": []}
 
-        top_results = search_result[:5]
-        formatted_results = [
-            {
-                "rank": i,
-                "id": r.get('id', f'result_{i}'),
-                "score": r['score'] * 100,
-                "text": r['text'],
-                "file_name": r.get('metadata', {}).get('file_name', 'Неизвестно'),
-                "file_path": r.get('metadata', {}).get('file_path', 'Неизвестно'),
-                "file_extension": r.get('metadata', {}).get('file_extension', 'Неизвестно'),
-                "chunk_index": r.get('metadata', {}).get('chunk_index', 0)
-            } for i, r in enumerate(top_results, 1)
-        ]
-        return {
-            "status": "success",
-            "message": f"Найдено результатов: {len(search_result)}",
-            "count": len(formatted_results),
-            "results": formatted_results
-        }
+        return StreamingResponse(stream_search_results(search_result), media_type="application/json")
     except Exception as e:
         logger.exception("Ошибка поиска")
         return {"status": "error", "message": f"Ошибка при выполнении поиска: {str(e)}", "results": []}
@@ -507,8 +913,9 @@ async def message_input(request: SearchRequest):
 async def get_task_status(task_id: str):
     """Проверка статуса задачи по ID - legacy endpoint для обратной совместимости"""
     try:
-        task = celery_app.AsyncResult(task_id)
-        state = task.state
+        meta = await get_task_meta(task_id)
+        state = meta["status"]
+        info = meta.get("result")
 
         if state == 'PENDING':
             return {
@@ -520,7 +927,7 @@ async def get_task_status(task_id: str):
                 "message": "Задача в очереди..."
             }
         elif state == 'PROGRESS':
-            info = task.info or {}
+            info = info or {}
             return {
                 "task_id": task_id,
                 "status": "processing",
@@ -531,7 +938,7 @@ async def get_task_status(task_id: str):
                 "filename": info.get('filename', '')
             }
         elif state == 'SUCCESS':
-            result_data = task.result or {}
+            result_data = info or {}
             return {
                 "task_id": task_id,
                 "status": "completed",
@@ -542,10 +949,10 @@ async def get_task_status(task_id: str):
                 "message": f"Обработка завершена"
             }
         elif state == 'FAILURE':
-            error_info = normalize_error(task.info or {})
+            error_info = normalize_error(info or {})
             return {"task_id": task_id, "state": "FAILURE", "error": error_info}
         else:
-            return {"task_id": task_id, "status": state.lower(), "message": str(task.info)}
+            return {"task_id": task_id, "status": state.lower(), "message": str(info)}
 
     except Exception as e:
         logger.exception("Ошибка получения статуса задачи")
@@ -32,6 +32,9 @@ class DocumentChunker:
 
         total_chunks = len(self.text)
         current_position = 0
+
+        # Бизнес-метаданные одинаковы для всех чанков файла: словарь строится один раз
+        business_dict = (business_metadata.to_dict() or None) if business_metadata else None
         
         for i, text_chunk in enumerate(self.text):
             word_count = len(text_chunk.split())
@@ -54,11 +57,13 @@ class DocumentChunker:
                 text=text_chunk,
                 metadata=chunk_metadata,
                 word_count=word_count,
-                char_count=char_count,
-                business_metadata=business_metadata
+                char_count=char_count
             )
             
-            self.unit_chunk.append(chunk.to_dict())
+            chunk_dict = chunk.to_dict(include_business=False)
+            if business_dict is not None:
+                chunk_dict['business_metadata'] = business_dict
+            self.unit_chunk.append(chunk_dict)
             
             current_position += char_count + 1
         
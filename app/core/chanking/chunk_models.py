@@ -78,6 +78,44 @@ class BusinessMetadata:
     status_name: Optional[str] = None
     status_status: Optional[int] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+
+        """Преобразует бизнес-метаданные в словарь для payload чанка; незаполненные поля не включаются"""
+
+        fields = {
+            'doc_number': self.doc_number,
+            'file_path': self.file_path,
+            
+            'customer_name': self.customer_name,
+            'customer_status': self.customer_status,
+            'enterprise_name': self.enterprise_name,
+            'enterprise_status': self.enterprise_status,
+            'stage_name': self.stage_name,
+            'stage_status': self.stage_status,
+            'title_number_name': self.title_number_name,
+            'title_number_name_status': self.title_number_name_status,
+            'title_name': self.title_name,
+            'title_status': self.title_status,
+            'discipline_code_name': self.discipline_code_name,
+            'discipline_code_status': self.discipline_code_status,
+            'mark_name': self.mark_name,
+            'mark_status': self.mark_status,
+            'title': self.title,
+            'version_name': self.version_name,
+            'version_status': self.version_status,
+            'language_name': self.language_name,
+            'language_status': self.language_status,
+            'gip_name': self.gip_name,
+            'gip_status': self.gip_status,
+            'developer_name': self.developer_name,
+            'developer_status': self.developer_status,
+            'region_name': self.region_name,
+            'region_status': self.region_status,
+            'status_name': self.status_name,
+            'status_status': self.status_status,
+        }
+        return {key: value for key, value in fields.items() if value is not None}
+
 @dataclass
 class DocumentChunkData:
 
@@ -111,39 +149,7 @@ class DocumentChunkData:
         }
         
         if include_business and self.business_metadata:
-            result['business_metadata'] = {
-                'doc_number': self.business_metadata.doc_number,
-                'file_path': self.business_metadata.file_path,
-                
-                'customer_name': self.business_metadata.customer_name,
-                'customer_status': self.business_metadata.customer_status,
-                'enterprise_name': self.business_metadata.enterprise_name,
-                'enterprise_status': self.business_metadata.enterprise_status,
-                'stage_name': self.business_metadata.stage_name,
-                'stage_status': self.business_metadata.stage_status,
-                'title_number_name': self.business_metadata.title_number_name,
-                'title_number_name_status': self.business_metadata.title_number_name_status,
-                'title_name': self.business_metadata.title_name,
-                'title_status': self.business_metadata.title_status,
-                'discipline_code_name': self.business_metadata.discipline_code_name,
-                'discipline_code_status': self.business_metadata.discipline_code_status,
-                'mark_name': self.business_metadata.mark_name,
-                'mark_status': self.business_metadata.mark_status,
-                'title': self.business_metadata.title,
-                'title_status': self.business_metadata.title_status,
-                'version_name': self.business_metadata.version_name,
-                'version_status': self.business_metadata.version_status,
-                'language_name': self.business_metadata.language_name,
-                'language_status': self.business_metadata.language_status,
-                'gip_name': self.business_metadata.gip_name,
-                'gip_status': self.business_metadata.gip_status,
-                'developer_name': self.business_metadata.developer_name,
-                'developer_status': self.business_metadata.developer_status,
-                'region_name': self.business_metadata.region_name,
-                'region_status': self.business_metadata.region_status,
-                'status_name': self.business_metadata.status_name,
-                'status_status': self.business_metadata.status_status,
-            }
+            result['business_metadata'] = self.business_metadata.to_dict()
         
         return result
 
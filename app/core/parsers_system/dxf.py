@@ -1,11 +1,21 @@
 from typing import List, Dict, Any
 import ezdxf
+import io
 import re
 import hashlib
-from collections import defaultdict
+from collections import Counter, defaultdict
 from .super_class import BaseParser, ParserResult
 
 
+# Управляющие последовательности переноса строки: \P, \p, \n
+_LINE_BREAK_RE = re.compile(r'\\[Ppn]')
+# Группы форматирования вида {\C1;Some text}
+_FORMAT_GROUP_RE = re.compile(r'\{\\[A-Za-z0-9]+;([^}]*)\}')
+# Escape-последовательности вида \H2.5; или \W0.8;
+_ESCAPE_RE = re.compile(r'\\[A-Za-z]+[0-9\.\-]*;?')
+_SPACES_RE = re.compile(r'[ \t]+')
+
+
 class DXFParser(BaseParser):
     """Парсер DXF файлов (AutoCAD Drawing Exchange Format)"""
     
@@ -19,7 +29,8 @@ class DXFParser(BaseParser):
         
         Args:
             file_path: Путь к DXF файлу
-            **params: Дополнительные параметры (игнорируются)
+            **params: Дополнительные параметры
+                include_metadata: собирать ли метаданные документа (по умолчанию True)
             
         Returns:
             ParserResult с текстовым содержимым
@@ -51,13 +62,15 @@ class DXFParser(BaseParser):
             # Формирование итогового текста
             final_text = self._format_text_output(deduplicated_data)
             
-            # Минимальные метаданные
-            metadata = {
-                'dxf_version': str(dxf_doc.dxfversion),
-                'total_texts': len(deduplicated_data),
-                'unique_texts': len(deduplicated_data),
-                'text_types': self._count_text_types(deduplicated_data)
-            }
+            # Минимальные метаданные (только если они нужны вызывающему коду)
+            metadata = {}
+            if params.get('include_metadata', True):
+                metadata = {
+                    'dxf_version': str(dxf_doc.dxfversion),
+                    'total_texts': len(deduplicated_data),
+                    'unique_texts': len(deduplicated_data),
+                    'text_types': self._count_text_types(deduplicated_data)
+                }
             
             return ParserResult(
                 success=True,
@@ -87,15 +100,10 @@ class DXFParser(BaseParser):
         handler = self._entity_handlers().get(entity_type)
         
         if handler:
+            # Обработчики возвращают список записей или None
             result = handler(entity, context)
-            if result is not None:
-                if isinstance(result, list):
-                    for item in result:
-                        item['original_entity'] = entity
-                        self.extracted_texts.append(item)
-                else:
-                    result['original_entity'] = entity
-                    self.extracted_texts.append(result)
+            if result:
+                self.extracted_texts.extend(result)
     
     def _entity_handlers(self):
         """Словарь обработчиков по типу сущности"""
@@ -110,76 +118,75 @@ class DXFParser(BaseParser):
     
     def _extract_text_data(self, entity, context):
         """Извлечение TEXT"""
-        text = entity.dxf.text
-        if not text or not text.strip():
+        dxf = entity.dxf
+        text = (dxf.text or '').strip()
+        if not text:
             return None
             
-        return {
+        return [{
             'type': 'TEXT',
             'text': text,
             'plain_text': self._extract_plain_text(text),
             'context': context,
-            'position': getattr(entity.dxf, 'insert', None)
-        }
+            'position': getattr(dxf, 'insert', None)
+        }]
     
     def _extract_mtext_data(self, entity, context):
         """Извлечение MTEXT"""
-        text = entity.text
-        if not text or not text.strip():
+        text = (entity.text or '').strip()
+        if not text:
             return None
             
-        return {
+        return [{
             'type': 'MTEXT',
             'text': text,
             'plain_text': self._extract_plain_text(text),
             'context': context,
             'position': getattr(entity, 'insert', None)
-        }
+        }]
     
     def _extract_attdef_data(self, entity, context):
         """Извлечение ATTDEF"""
-        text = entity.dxf.text
-        if not text or not text.strip():
+        dxf = entity.dxf
+        text = (dxf.text or '').strip()
+        if not text:
             return None
             
-        tag = getattr(entity.dxf, 'tag', '')
-        return {
+        return [{
             'type': 'ATTDEF',
             'text': text,
             'plain_text': self._extract_plain_text(text),
-            'tag': tag,
+            'tag': getattr(dxf, 'tag', ''),
             'context': context,
-            'position': getattr(entity.dxf, 'insert', None)
-        }
+            'position': getattr(dxf, 'insert', None)
+        }]
     
     def _extract_attrib_data(self, entity, context):
         """Извлечение ATTRIB"""
-        text = entity.dxf.text
-        if not text or not text.strip():
+        dxf = entity.dxf
+        text = (dxf.text or '').strip()
+        if not text:
             return None
             
-        tag = getattr(entity.dxf, 'tag', '')
-        return {
+        return [{
             'type': 'ATTRIB',
             'text': text,
             'plain_text': self._extract_plain_text(text),
-            'tag': tag,
+            'tag': getattr(dxf, 'tag', ''),
             'context': context,
-            'position': getattr(entity.dxf, 'insert', None)
-        }
+            'position': getattr(dxf, 'insert', None)
+        }]
     
     def _extract_insert_data(self, entity, context):
         """Извлечение атрибутов из INSERT (блоков)"""
         attribs = getattr(entity, 'attribs', [])
         attrib_texts = []
+        insert_context = f'insert_{getattr(entity.dxf, "name", "unknown")}'
         
         for attrib in attribs:
-            attrib_data = self._extract_attrib_data(
-                attrib, 
-                context=f'insert_{getattr(entity.dxf, "name", "unknown")}'
-            )
+            attrib_data = self._extract_attrib_data(attrib, context=insert_context)
             if attrib_data:
-                attrib_texts.append(attrib_data)
+                attrib_texts.extend(attrib_data)
         
         return attrib_texts if attrib_texts else None
     
@@ -201,8 +208,9 @@ class DXFParser(BaseParser):
                 if entity_type in ['TEXT', 'MTEXT']:
                     # Определяем текст в зависимости от типа
                     if entity_type == 'TEXT':
-                        entity_text = proxy_entity.dxf.text
-                        position = getattr(proxy_entity.dxf, 'insert', None)
+                        proxy_dxf = proxy_entity.dxf
+                        entity_text = proxy_dxf.text
+                        position = getattr(proxy_dxf, 'insert', None)
                     else:  # MTEXT
                         entity_text = proxy_entity.text
                         position = getattr(proxy_entity, 'insert', None)
@@ -256,7 +264,7 @@ class DXFParser(BaseParser):
             
             # Создаём запись для таблицы
             if table_rows:
-                table_text = '\n'.join(table_rows)
+                table_text = '\n'.join(table_rows).strip()
                 table_texts.append({
                     'type': 'ACAD_TABLE',
                     'text': table_text,
@@ -277,20 +285,25 @@ class DXFParser(BaseParser):
         if not text:
             return text
         
+        # Быстрый путь: нет ни управляющих последовательностей, ни скобок, ни лишних пробелов
+        if ('\\' not in text and '{' not in text and '}' not in text
+                and '\t' not in text and '  ' not in text):
+            return text.strip()
+        
         # Нормализация управляющих последовательностей
-        clean = text.replace('\\P', '\n').replace('\\p', '\n').replace('\\n', '\n')
+        clean = _LINE_BREAK_RE.sub('\n', text)
         
         # Обработка групп вида {\C1;Some text}
-        clean = re.sub(r'\{\\[A-Za-z0-9]+;([^}]*)\}', r'\1', clean)
+        clean = _FORMAT_GROUP_RE.sub(r'\1', clean)
         
         # Удаляем escape-последовательности
-        clean = re.sub(r'\\[A-Za-z]+[0-9\.\-]*;?', '', clean)
+        clean = _ESCAPE_RE.sub('', clean)
         
         # Убираем фигурные скобки
         clean = clean.replace('{', '').replace('}', '')
         
         # Сжимаем множественные пробелы
-        clean = re.sub(r'[ \t]+', ' ', clean).strip()
+        clean = _SPACES_RE.sub(' ', clean).strip()
         
         return clean
     
@@ -300,8 +313,8 @@ class DXFParser(BaseParser):
         unique_data = []
         
         for item in text_data:
-            full_text_content = item["text"].strip()
-            text_hash = hashlib.md5(full_text_content.encode('utf-8')).hexdigest()
+            # Обработчики уже сохраняют текст без крайних пробелов
+            text_hash = hashlib.md5(item["text"].encode('utf-8')).hexdigest()
             text_groups[text_hash].append(item)
         
         for text_hash, items in text_groups.items():
@@ -318,19 +331,22 @@ class DXFParser(BaseParser):
     
     def _format_text_output(self, text_data: List[Dict]) -> str:
         """Форматирование итогового текстового вывода"""
-        output_lines = []
+        buf = io.StringIO()
+        write = buf.write
         
         # Группируем по контексту
         by_context = defaultdict(list)
         for item in text_data:
             by_context[item.get('context', 'unknown')].append(item)
         
-        # Выводим тексты по контекстам
+        # Выводим тексты по контекстам (каждая строка, кроме первой, начинается с '\n')
         for context in sorted(by_context.keys()):
             items = by_context[context]
             
             # Заголовок секции
-            output_lines.append(f"\n=== {context.upper()} ===\n")
+            if buf.tell():
+                write('\n')
+            write(f"\n=== {context.upper()} ===\n")
             
             for item in items:
                 plain_text = item.get('plain_text', '').strip()
@@ -341,24 +357,22 @@ class DXFParser(BaseParser):
                     if text_type == 'ACAD_TABLE':
                         rows = item.get('rows_count', 0)
                         cols = item.get('cols_count', 0)
-                        output_lines.append(f"[TABLE {rows}x{cols}]")
-                        output_lines.append(plain_text)
-                        output_lines.append("")
+                        write(f"\n[TABLE {rows}x{cols}]\n")
+                        write(plain_text)
+                        write('\n')
                     # Для атрибутов показываем тег
                     elif 'tag' in item and item['tag']:
-                        output_lines.append(f"[{item['tag']}]: {plain_text}")
+                        write(f"\n[{item['tag']}]: {plain_text}")
                     # Для обычного текста
                     else:
-                        output_lines.append(plain_text)
+                        write('\n')
+                        write(plain_text)
         
-        return '\n'.join(output_lines)
+        return buf.getvalue()
     
     def _count_text_types(self, text_data: List[Dict]) -> Dict[str, int]:
         """Подсчёт количества текстов по типам"""
-        counts = defaultdict(int)
-        for item in text_data:
-            counts[item.get('type', 'UNKNOWN')] += 1
-        return dict(counts)
+        return dict(Counter(item.get('type', 'UNKNOWN') for item in text_data))
     
     def get_supported_extensions(self) -> List[str]:
         """Поддерживаемые расширения файлов"""
@@ -1,9 +1,30 @@
 from typing import List
+from functools import lru_cache
 from PIL import Image
+import os
 
 from .super_class import BaseParser, ParserResult
 from loguru import logger
-import pytesseract
+
+
+# Путь к tesseract по умолчанию на Windows; переопределяется переменной окружения TESSERACT_CMD
+_WINDOWS_TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+
+@lru_cache(maxsize=1)
+def get_pytesseract():
+
+    """Ленивая загрузка pytesseract с настройкой пути к tesseract"""
+
+    import pytesseract
+
+    tesseract_cmd = os.environ.get('TESSERACT_CMD')
+    if tesseract_cmd is None and os.path.exists(_WINDOWS_TESSERACT_CMD):
+        tesseract_cmd = _WINDOWS_TESSERACT_CMD
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    return pytesseract
 
 class ImageOCRParser(BaseParser):
 
@@ -57,7 +78,7 @@ class ImageOCRParser(BaseParser):
 
         """Выполнение OCR"""
 
-        return pytesseract.image_to_string(image, lang=self.ocr_language)
+        return get_pytesseract().image_to_string(image, lang=self.ocr_language)
     
 
     def get_supported_extensions(self) -> List[str]:
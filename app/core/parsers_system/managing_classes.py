@@ -1,8 +1,7 @@
-from typing import List, Dict, Any, Optional, Type
-from pathlib import Path
+from typing import List, Dict, Any, Optional, Type, ClassVar, Collection
+from pathlib import PureWindowsPath
 import mimetypes
-import pytesseract
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+import os
 from .docx import DOCXParser
 from .pdf import PDFParser
 from .plain_text import PlainTextParser
@@ -18,25 +17,42 @@ from .doc import DOCParser
 class FileValidator:
 
     """Валидатор файлов"""
+
+    # Предельный размер файла для обработки по умолчанию
+    MAX_FILE_SIZE: ClassVar[int] = 100 * 1024 * 1024
     
     @staticmethod
     def validate_file_exists(file_path: str) -> bool:
-        return Path(file_path).exists()
+        return os.path.exists(file_path)
     
 
     @staticmethod
     def validate_file_size(file_path: str, max_size: int) -> bool:
-        if not Path(file_path).exists():
+        try:
+            return os.stat(file_path).st_size <= max_size
+        except FileNotFoundError:
             return False
-        return Path(file_path).stat().st_size <= max_size
     
 
     @staticmethod
-    def validate_file_type(file_path: str, expected_extensions: List[str]) -> bool:
-        ext = Path(file_path).suffix.lower()
+    def validate_file_type(file_path: str, expected_extensions: Collection[str]) -> bool:
+        ext = os.path.splitext(file_path)[1].lower()
         return ext in expected_extensions
     
 
+    @staticmethod
+    def validate(file_path: str, max_size: int, expected_extensions: Collection[str], min_size: int = 0) -> bool:
+
+        """Проверка существования, размера и типа файла за один вызов stat"""
+
+        if os.path.splitext(file_path)[1].lower() not in expected_extensions:
+            return False
+        try:
+            return min_size <= os.stat(file_path).st_size <= max_size
+        except FileNotFoundError:
+            return False
+    
+
     @staticmethod
     def get_file_mime_type(file_path: str) -> str:
         mime_type, _ = mimetypes.guess_type(file_path)
@@ -47,12 +63,13 @@ class DepartmentConfig:
 
     """Конфигурация парсеров для отдела"""
     
-    def __init__(self, department_name: str, max_file_size: int = 100 * 1024 * 1024, timeout: int = 300):
+    def __init__(self, department_name: str, max_file_size: int = FileValidator.MAX_FILE_SIZE, timeout: int = 300):
         self.department_name = department_name
         self.allowed_parsers: Dict[str, List[Type[BaseParser]]] = {}
         self.max_file_size = max_file_size
         self.timeout = timeout
         self._parser_priorities: Dict[str, Dict[Type[BaseParser], int]] = {}
+        self._sorted_cache: Dict[str, List[Type[BaseParser]]] = {}
     
 
     def get_allowed_extensions(self) -> List[str]:
@@ -80,6 +97,19 @@ class DepartmentConfig:
         if extension not in self._parser_priorities:
             self._parser_priorities[extension] = {}
         self._parser_priorities[extension][parser_class] = priority
+        self._sorted_cache.pop(extension, None)
+    
+
+    def get_sorted_parsers(self, extension: str) -> List[Type[BaseParser]]:
+        sorted_parsers = self._sorted_cache.get(extension)
+        if sorted_parsers is None:
+            priorities = self._parser_priorities.get(extension, {})
+            sorted_parsers = sorted(
+                self.allowed_parsers.get(extension, []),
+                key=lambda p: priorities.get(p, 999)
+            )
+            self._sorted_cache[extension] = sorted_parsers
+        return sorted_parsers
 
 
 class ParserRegistry:
@@ -106,11 +136,11 @@ class ParserRegistry:
     
 
     def get_parsers_for_department(self, department: str, extension: str) -> List[Type[BaseParser]]:
-        if department in self.department_registries:
-            dept_config = self.department_registries[department]
-            parsers = dept_config.allowed_parsers.get(extension, [])
+        dept_config = self.department_registries.get(department)
+        if dept_config is not None:
+            parsers = dept_config.get_sorted_parsers(extension)
             if parsers:
-                return sorted(parsers, key=lambda p: dept_config.get_parser_priority(extension, p))
+                return parsers
         
         return self.global_registry.get(extension, [])
     
@@ -125,58 +155,68 @@ class ParserRegistry:
 class ParserManager:
 
     """Менеджер парсеров с поддержкой отделов"""
+
+    # Стандартное соответствие расширение → парсер, строится один раз при импорте
+    _DEFAULT_PARSERS: ClassVar[Dict[str, Type[BaseParser]]] = {
+        'pdf': PDFParser,
+        'docx': DOCXParser,
+        'doc': DOCParser,
+        'xlsx': XLSXParser,
+        'xls': XLSParser,
+        'txt': PlainTextParser,
+        'dxf': DXFParser,
+        'dwg': DWGParser,
+        'png': ImageOCRParser,
+        'jpg': ImageOCRParser,
+        'jpeg': ImageOCRParser,
+        'tiff': ImageOCRParser,
+        'bmp': ImageOCRParser,
+    }
     
     def __init__(self):
         self.parser_registry = ParserRegistry()
         self.parser_instances: Dict[Type[BaseParser], BaseParser] = {}
         self.file_validator = FileValidator()
+        self._ext_to_parser: Dict[str, Type[BaseParser]] = {}
         
         self._init_default_parsers()
     
 
     def _init_default_parsers(self):
 
-        """Инициализация стандартных парсеров"""
-
-        default_parsers = {
-            'pdf': PDFParser,
-            'docx': DOCXParser,
-            'doc': DOCParser,
-            'xlsx': XLSXParser,
-            'xls': XLSParser,
-            'txt': PlainTextParser,
-            'dxf': DXFParser,
-            'dwg': DWGParser,
-            'png': ImageOCRParser,
-            'jpg': ImageOCRParser,
-            'jpeg': ImageOCRParser,
-            'tiff': ImageOCRParser,
-            'bmp': ImageOCRParser,
-        }
-
-        return default_parsers
+        """Инициализация стандартных парсеров: таблица диспетчеризации и глобальный реестр"""
+
+        self._ext_to_parser = dict(self._DEFAULT_PARSERS)
+        for extension, parser_class in self._ext_to_parser.items():
+            self.parser_registry.register_global_parser(extension, parser_class)
     
             
     def _parser_extension(self, file_path: str) -> str:
 
         """Получение расширения файла"""
 
-        return file_path.lower().split('.')[-1] if file_path else ''
+        return os.path.splitext(file_path)[1][1:].lower() if file_path else ''
     
 
-    def _find_parser_in_registry(self, extension: str) -> Optional[Type[BaseParser]]:
+    def _find_parser_in_registry(self, extension: str, department: Optional[str] = None) -> Optional[Type[BaseParser]]:
 
-        """Поиск подходящего парсера в реестре"""
+        """Поиск подходящего парсера в реестре (с учётом отдела, если он указан)"""
 
-        return self._init_default_parsers().get(extension)
+        if department is not None:
+            parsers = self.parser_registry.get_parsers_for_department(department, extension)
+            return parsers[0] if parsers else None
+        return self._ext_to_parser.get(extension)
     
 
     def _save_parser_instance(self, parser_class: Type[BaseParser]):
 
-        """Сохранение экземпляра парсера"""
+        """Получение экземпляра парсера из кэша (с созданием при первом обращении)"""
 
-        if parser_class not in self.parser_instances:
-            self.parser_instances[parser_class] = parser_class()
+        parser_instance = self.parser_instances.get(parser_class)
+        if parser_instance is None:
+            parser_instance = parser_class()
+            self.parser_instances[parser_class] = parser_instance
+        return parser_instance
 
     def _ransfer_selected_parser(self, file_path: str, parser_class: Type[BaseParser]):
 
@@ -184,7 +224,7 @@ class ParserManager:
 
         if parser_class is None:
             return None
-        parser_instance = parser_class()
+        parser_instance = self._save_parser_instance(parser_class)
         return parser_instance.parse(file_path)
     
     
@@ -192,4 +232,5 @@ class ParserManager:
 
         """Получение имени файла из пути"""
 
-        return file_path.lower().split('\\')[-1] if file_path else None
+        # PureWindowsPath разделяет и по '\\', и по '/'
+        return PureWindowsPath(file_path).name.lower() if file_path else None
@@ -6,8 +6,8 @@ from loguru import logger
 import time
 import io
 import pymupdf as fitz
-import pytesseract
 from PIL import Image
+from .image import get_pytesseract
 
 class PDFParser(BaseParser):
 
@@ -29,16 +29,18 @@ class PDFParser(BaseParser):
             ocr_language = params.get('ocr_language', self.ocr_language)
             pages = params.get('pages', None)
             
-            # Выбираем метод парсинга
-            if use_ocr:
-                text, metadata = self._extract_with_ocr(file_path, pages, ocr_language)
-                method = "ocr"
-            else:
-                text, metadata = self._extract_with_pymupdf(file_path, pages)
-                method = "text_extraction"
-            
-            # Извлекаем метаданные
-            pdf_metadata = self._extract_pdf_metadata(file_path)
+            # Документ открывается один раз: и текст, и метаданные читаются из него
+            with fitz.open(file_path) as doc:
+                # Выбираем метод парсинга
+                if use_ocr:
+                    text, metadata = self._extract_with_ocr(doc, pages, ocr_language)
+                    method = "ocr"
+                else:
+                    text, metadata = self._extract_with_pymupdf(doc, pages)
+                    method = "text_extraction"
+                
+                # Извлекаем метаданные
+                pdf_metadata = self._extract_pdf_metadata(doc, file_path)
             
             # Формируем итоговые метаданные
             final_metadata = {
@@ -70,35 +72,34 @@ class PDFParser(BaseParser):
             )
     
 
-    def _extract_with_pymupdf(self, file_path: str, pages: List[int] = None) -> tuple:
+    def _extract_with_pymupdf(self, doc: fitz.Document, pages: List[int] = None) -> tuple:
 
         """Извлечение текста с помощью PyMuPDF"""
         
         text = ""
         metadata = {}
         
-        with fitz.open(file_path) as doc:
-            metadata['total_pages'] = len(doc)
-            metadata['is_encrypted'] = doc.is_encrypted
-            
-            # Определяем страницы для обработки
-            if pages:
-                page_indices = [p-1 for p in pages if 1 <= p <= len(doc)]
-            else:
-                page_indices = range(len(doc))
-            
-            for page_num in page_indices:
-                page = doc[page_num]
-                page_text = page.get_text()
-                if page_text.strip():
-                    text += f"--- Страница {page_num + 1} ---\n{page_text}\n"
-            
-            metadata['pages_processed'] = len(page_indices)
+        metadata['total_pages'] = len(doc)
+        metadata['is_encrypted'] = doc.is_encrypted
+        
+        # Определяем страницы для обработки
+        if pages:
+            page_indices = [p-1 for p in pages if 1 <= p <= len(doc)]
+        else:
+            page_indices = range(len(doc))
+        
+        for page_num in page_indices:
+            page = doc[page_num]
+            page_text = page.get_text()
+            if page_text.strip():
+                text += f"--- Страница {page_num + 1} ---\n{page_text}\n"
+        
+        metadata['pages_processed'] = len(page_indices)
         
         return text, metadata
     
 
-    def _extract_with_ocr(self, file_path: str, pages: List[int] = None, language: str = "rus+eng") -> tuple:
+    def _extract_with_ocr(self, doc: fitz.Document, pages: List[int] = None, language: str = "rus+eng") -> tuple:
 
         """Извлечение текста с помощью OCR"""
         
@@ -108,60 +109,58 @@ class PDFParser(BaseParser):
             'ocr_engine': 'tesseract'
         }
         
-        with fitz.open(file_path) as doc:
-            metadata['total_pages'] = len(doc)
+        metadata['total_pages'] = len(doc)
+        
+        # Определяем страницы для обработки
+        if pages:
+            page_indices = [p-1 for p in pages if 1 <= p <= len(doc)]
+        else:
+            page_indices = range(len(doc))
+        
+        ocr_pages_count = 0
+        
+        for page_num in page_indices:
+            page = doc[page_num]
             
-            # Определяем страницы для обработки
-            if pages:
-                page_indices = [p-1 for p in pages if 1 <= p <= len(doc)]
+            # Сначала пробуем извлечь обычный текст
+            page_text = page.get_text()
+            if page_text.strip():
+                text += f"--- Страница {page_num + 1} (ТЕКСТ) ---\n{page_text}\n"
             else:
-                page_indices = range(len(doc))
-            
-            ocr_pages_count = 0
-            
-            for page_num in page_indices:
-                page = doc[page_num]
+                # Если текста нет - используем OCR
+                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # Увеличиваем разрешение
+                img_data = pix.tobytes("png")
                 
-                # Сначала пробуем извлечь обычный текст
-                page_text = page.get_text()
-                if page_text.strip():
-                    text += f"--- Страница {page_num + 1} (ТЕКСТ) ---\n{page_text}\n"
-                else:
-                    # Если текста нет - используем OCR
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # Увеличиваем разрешение
-                    img_data = pix.tobytes("png")
-                    
-                    with Image.open(io.BytesIO(img_data)) as img:
-                        ocr_text = pytesseract.image_to_string(img, lang=language)
-                        if ocr_text.strip():
-                            text += f"--- Страница {page_num + 1} (OCR) ---\n{ocr_text}\n"
-                            ocr_pages_count += 1
-            
-            metadata['pages_processed'] = len(page_indices)
-            metadata['ocr_pages'] = ocr_pages_count
+                with Image.open(io.BytesIO(img_data)) as img:
+                    ocr_text = get_pytesseract().image_to_string(img, lang=language)
+                    if ocr_text.strip():
+                        text += f"--- Страница {page_num + 1} (OCR) ---\n{ocr_text}\n"
+                        ocr_pages_count += 1
         
+        metadata['pages_processed'] = len(page_indices)
+        metadata['ocr_pages'] = ocr_pages_count
+    
         return text, metadata
     
 
-    def _extract_pdf_metadata(self, file_path: str) -> Dict[str, Any]:
+    def _extract_pdf_metadata(self, doc: fitz.Document, file_path: str) -> Dict[str, Any]:
 
         """Извлечение метаданных PDF"""
         
         metadata = {}
         
         try:
-            with fitz.open(file_path) as doc:
-                pdf_metadata = doc.metadata
-                metadata.update({
-                    'author': pdf_metadata.get('author', ''),
-                    'title': pdf_metadata.get('title', ''),
-                    'subject': pdf_metadata.get('subject', ''),
-                    'keywords': pdf_metadata.get('keywords', ''),
-                    'creator': pdf_metadata.get('creator', ''),
-                    'producer': pdf_metadata.get('producer', ''),
-                    'creation_date': pdf_metadata.get('creationDate', ''),
-                    'modification_date': pdf_metadata.get('modDate', ''),
-                })
+            pdf_metadata = doc.metadata
+            metadata.update({
+                'author': pdf_metadata.get('author', ''),
+                'title': pdf_metadata.get('title', ''),
+                'subject': pdf_metadata.get('subject', ''),
+                'keywords': pdf_metadata.get('keywords', ''),
+                'creator': pdf_metadata.get('creator', ''),
+                'producer': pdf_metadata.get('producer', ''),
+                'creation_date': pdf_metadata.get('creationDate', ''),
+                'modification_date': pdf_metadata.get('modDate', ''),
+            })
         except:
             pass  # Игнорируем ошибки метаданных
         
@@ -1,3 +1,5 @@
+import mmap
+import os
 from typing import List, Optional
 from .super_class import BaseParser, ParserResult
 from loguru import logger
@@ -38,18 +40,35 @@ class PlainTextParser(BaseParser):
 
     def _try_encodings(self, file_path: str) -> str:
 
-        """Попытка прочитать с разными кодировками"""
-
-        for encoding in self.encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    return f.read()
-            except UnicodeDecodeError:
-                continue
-        
-        # Последняя попытка с игнорированием ошибок
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
+        """
+        Попытка прочитать с разными кодировками.
+        Файл отображается в память (mmap) один раз: каждая попытка декодирует
+        страницы напрямую, без повторного чтения и промежуточной копии в bytes
+        """
+
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for encoding in self.encodings:
+                    try:
+                        return self._normalize_newlines(str(mm, encoding))
+                    except UnicodeDecodeError:
+                        continue
+                
+                # Последняя попытка с игнорированием ошибок
+                return self._normalize_newlines(str(mm, 'utf-8', errors='ignore'))
+    
+
+    @staticmethod
+    def _normalize_newlines(text: str) -> str:
+
+        """Переводы строк как при чтении в текстовом режиме: \\r\\n и \\r -> \\n"""
+
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
     
 
     def get_supported_extensions(self) -> List[str]:
@@ -1,8 +1,27 @@
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from qdrant_client.http import models
-from typing import List, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import requests
+import asyncio
 import logging
+import threading
+import time
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
+try:
+    import uvloop  # type: ignore
+except Exception:
+    uvloop = None
+
 logger = logging.getLogger(__name__)
 from app.config import (
     QDRANT_HOST,
@@ -12,14 +31,87 @@ from app.config import (
     OLLAMA_URL
 )
 
+try:
+    from app.config import QDRANT_GRPC_PORT
+except ImportError:
+    QDRANT_GRPC_PORT = 6334
+
 # ===============================
 # CLIENT
 # ===============================
 
-client = QdrantClient(
-    host=QDRANT_HOST,
-    port=QDRANT_PORT,
-)
+_client: Optional[QdrantClient] = None
+
+
+def get_client() -> QdrantClient:
+    """
+    Клиент Qdrant текущего процесса, создаётся при первом обращении.
+    Импорт модуля не открывает соединений: gRPC-канал нельзя наследовать
+    через fork, поэтому каждый процесс воркера Celery создаёт свой.
+    """
+    global _client
+    if _client is None:
+        # gRPC передаёт векторы в бинарном виде вместо JSON; REST-порт остаётся для служебных вызовов
+        _client = QdrantClient(
+            host=QDRANT_HOST,
+            port=QDRANT_PORT,
+            grpc_port=QDRANT_GRPC_PORT,
+            prefer_grpc=True,
+        )
+    return _client
+
+
+_async_client: Optional[AsyncQdrantClient] = None
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_client() -> AsyncQdrantClient:
+    """
+    Асинхронный клиент Qdrant текущего процесса.
+    Его gRPC-канал привязан к циклу событий, поэтому использовать клиент
+    можно только внутри корутин, запущенных через run_async.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncQdrantClient(
+            host=QDRANT_HOST,
+            port=QDRANT_PORT,
+            grpc_port=QDRANT_GRPC_PORT,
+            prefer_grpc=True,
+        )
+    return _async_client
+
+
+def run_async(coro):
+    """
+    Выполняет корутину в постоянном цикле событий процесса.
+    В отличие от asyncio.run цикл не пересоздаётся на каждый вызов,
+    поэтому соединение асинхронного клиента переживает задачу.
+    Если установлен uvloop, цикл создаётся на нём, как и у API-сервера.
+    Если выполнение прервано (например, SoftTimeLimitExceeded), незавершённые задачи
+    цикла отменяются здесь же, чтобы они не продолжились в следующем вызове run_async.
+    """
+    global _event_loop
+    if _event_loop is None or _event_loop.is_closed():
+        _event_loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    try:
+        return _event_loop.run_until_complete(coro)
+    except BaseException:
+        _cancel_pending(_event_loop)
+        raise
+
+
+def _cancel_pending(loop: asyncio.AbstractEventLoop) -> None:
+    """Отменяет все незавершённые задачи цикла и дожидается их отмены"""
+    pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+    if not pending:
+        return
+    for task in pending:
+        task.cancel()
+    try:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    except BaseException as e:
+        logger.warning(f"Не удалось дождаться отмены задач цикла: {e}")
 
 # ===============================
 # INIT-ФУНКЦИИ
@@ -32,7 +124,7 @@ def init_qdrant() -> None:
     Вызывается ЯВНО (FastAPI startup / Celery init).
     """
     try:
-        client.get_collections()
+        get_client().get_collections()
         logger.info("Qdrant доступен")
     except Exception as e:
         logger.info(f"Qdrant недоступен: {e}")
@@ -43,6 +135,7 @@ def create_document_collection() -> None:
     """
     Создаёт коллекцию, если она не существует.
     """
+    client = get_client()
     if client.collection_exists(COLLECTION_NAME):
         logger.info(f"ℹ️ Коллекция '{COLLECTION_NAME}' уже существует")
         return
@@ -51,7 +144,18 @@ def create_document_collection() -> None:
         collection_name=COLLECTION_NAME,
         vectors_config=models.VectorParams(
             size=1024,
-            distance=models.Distance.COSINE
+            distance=models.Distance.COSINE,
+            on_disk=True
+        ),
+        # Payload (полный текст чанка и метаданные) хранится на диске, а не в RAM
+        on_disk_payload=True,
+        # INT8-копия векторов в RAM для поиска, оригиналы на диске для rescore
+        quantization_config=models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True
+            )
         )
     )
 
@@ -74,23 +178,161 @@ def create_document_collection() -> None:
 # OLLAMA
 # ===============================
 
+# Постоянная сессия: TCP-соединения к Ollama переиспользуются между запросами.
+# Повторяются только ошибки соединения и ответы 429/5xx. После таймаута чтения запрос
+# не повторяется (read=0): иначе медленный пакет /api/embed отправлялся бы заново
+# и держал воркер в несколько раз дольше OLLAMA_BATCH_TIMEOUT
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=3,
+        read=0,
+        backoff_factor=0.1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+)
+_session = requests.Session()
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# (connect, read) таймауты запросов к Ollama
+OLLAMA_TIMEOUT = (3.0, 60.0)
+OLLAMA_BATCH_TIMEOUT = (3.0, 300.0)
+
+# Количество текстов в одном запросе к /api/embed
+EMBED_BATCH_SIZE = 64
+
+# Сколько пакетов /api/embed отправляется одновременно
+EMBED_CONCURRENCY = 4
+
+# Параллелизм запасного пути (старые версии Ollama без /api/embed)
+EMBED_FALLBACK_WORKERS = 8
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _ollama_post(endpoint: str, payload: Dict[str, Any], timeout) -> requests.Response:
+    """
+    POST в Ollama; тело сериализуется через orjson, если он установлен.
+    """
+    url = f"{OLLAMA_URL}{endpoint}"
+    if orjson is not None:
+        return _session.post(url, data=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=timeout)
+    return _session.post(url, json=payload, timeout=timeout)
+
+
+def _response_json(response: requests.Response) -> Any:
+    """
+    Разбор JSON-ответа Ollama (список из 1024 float на каждый текст) через orjson, если он установлен.
+    """
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
 def get_embedding(text: str, model: str = OLLAMA_MODEL) -> List[float]:
     """
     Получает embedding из Ollama.
     """
-    response = requests.post(
-        f"{OLLAMA_URL}/api/embeddings",
-        json={
+    response = _ollama_post(
+        "/api/embeddings",
+        {
             "model": model,
             "prompt": text
         },
-        timeout=60
+        timeout=OLLAMA_TIMEOUT
+    )
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Ollama error: {response.text}")
+
+    return _response_json(response)["embedding"]
+
+
+def warm_up_ollama(model: str = OLLAMA_MODEL) -> bool:
+    """
+    Пробный embedding при старте сервиса: открывает соединение в пуле сессии
+    и заставляет Ollama загрузить модель, чтобы первый поисковый запрос
+    не ждал ни того, ни другого. Недоступная Ollama старт не останавливает.
+    """
+    try:
+        get_embedding("warm-up", model)
+        return True
+    except Exception as e:
+        logger.warning(f"Прогрев Ollama не удался: {e}")
+        return False
+
+
+def close_clients() -> None:
+    """Закрывает HTTP-сессию Ollama и клиент Qdrant текущего процесса"""
+    global _client
+    _session.close()
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+@lru_cache(maxsize=1024)
+def _get_query_embedding(query: str, model: str) -> Tuple[float, ...]:
+    """
+    Embedding поискового запроса с кэшированием: повторные запросы не ходят в Ollama.
+    """
+    return tuple(get_embedding(query, model))
+
+
+def get_embeddings(
+    texts: List[str],
+    model: str = OLLAMA_MODEL,
+    batch_size: int = EMBED_BATCH_SIZE
+) -> List[List[float]]:
+    """
+    Получает embeddings для списка текстов пакетами по batch_size через /api/embed.
+    Несколько пакетов отправляются параллельно (не больше EMBED_CONCURRENCY), порядок сохраняется.
+    Если эндпоинт не поддерживается (старая Ollama), считает их параллельно через /api/embeddings.
+    """
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    if len(batches) <= 1:
+        return _embed_batch(batches[0], model) if batches else []
+
+    embeddings: List[List[float]] = []
+    with ThreadPoolExecutor(max_workers=min(EMBED_CONCURRENCY, len(batches))) as executor:
+        for batch_embeddings in executor.map(lambda batch: _embed_batch(batch, model), batches):
+            embeddings.extend(batch_embeddings)
+
+    return embeddings
+
+
+def _embed_batch(texts: List[str], model: str) -> List[List[float]]:
+    """
+    Один запрос к /api/embed для пакета текстов.
+    """
+    response = _ollama_post(
+        "/api/embed",
+        {
+            "model": model,
+            "input": texts
+        },
+        timeout=OLLAMA_BATCH_TIMEOUT
     )
 
+    if response.status_code == 404:
+        logger.info("Ollama не поддерживает /api/embed, используется поштучный режим")
+        with ThreadPoolExecutor(max_workers=EMBED_FALLBACK_WORKERS) as executor:
+            return list(executor.map(lambda text: get_embedding(text, model), texts))
+
     if response.status_code != 200:
         raise RuntimeError(f"Ollama error: {response.text}")
 
-    return response.json()["embedding"]
+    embeddings = _response_json(response)["embeddings"]
+    if len(embeddings) != len(texts):
+        raise RuntimeError(
+            f"Ollama вернула {len(embeddings)} embeddings для {len(texts)} текстов"
+        )
+
+    return embeddings
 
 
 # ===============================
@@ -100,53 +342,156 @@ def get_embedding(text: str, model: str = OLLAMA_MODEL) -> List[float]:
 def create_embeddings_from_chunks(
     chunks: List[Dict[str, Any]],
     model: str = OLLAMA_MODEL
-) -> List[models.PointStruct]:
+) -> models.Batch:
     """
-    Создает PointStruct'ы для Qdrant.
+    Создает пакет точек для Qdrant в колоночном виде: отдельные списки id, векторов и payload
+    вместо объекта PointStruct на каждую точку.
     """
-    points: List[models.PointStruct] = []
+    ids: List[Any] = []
+    payloads: List[Dict[str, Any]] = []
+    embeddings = get_embeddings([chunk["text"] for chunk in chunks], model)
 
     for chunk in chunks:
-        embedding = get_embedding(chunk["text"], model)
-
-        point = models.PointStruct(
-            id=chunk["chunk_id"],
-            vector=embedding,
-            payload={
-                "text": chunk["text"],
-                "word_count": chunk.get("word_count"),
-                "char_count": chunk.get("char_count"),
-                "metadata": chunk.get("metadata"),
-                "business_metadata": chunk.get("business_metadata"),
-            }
-        )
-
-        points.append(point)
+        ids.append(chunk["chunk_id"])
+        payloads.append({
+            "text": chunk["text"],
+            "word_count": chunk.get("word_count"),
+            "char_count": chunk.get("char_count"),
+            "metadata": chunk.get("metadata"),
+            # Пустые бизнес-метаданные не попадают в чанк ещё в DocumentChunker.uniter
+            "business_metadata": chunk.get("business_metadata"),
+        })
 
-    return points
+    return models.Batch(ids=ids, vectors=embeddings, payloads=payloads)
 
 
 def add_chunks_to_qdrant(
     chunks: List[Dict[str, Any]],
-    model: str = OLLAMA_MODEL
+    model: str = OLLAMA_MODEL,
+    wait: bool = False
 ) -> int:
     """
     Добавляет чанки в Qdrant.
+    По умолчанию не ждёт применения пакетов (wait=False): Qdrant подтверждает приём,
+    а индексация идёт в фоне.
     Возвращает количество добавленных точек.
     """
     if not chunks:
         logger.info("Нет чанков для загрузки в Qdrant")
         return 0
 
-    points = create_embeddings_from_chunks(chunks, model)
+    client = get_client()
 
-    client.upsert(
-        collection_name=COLLECTION_NAME,
-        points=points
-    )
+    total_points = 0
+    pending_upsert = None
+
+    # Пока Qdrant принимает предыдущий пакет, считаем embeddings следующего.
+    # В полёте не больше одного пакета, поэтому память ограничена двумя пакетами.
+    with ThreadPoolExecutor(max_workers=1) as upsert_executor:
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            points = create_embeddings_from_chunks(chunks[start:start + EMBED_BATCH_SIZE], model)
+
+            if pending_upsert is not None:
+                pending_upsert.result()
+
+            pending_upsert = upsert_executor.submit(
+                client.upsert,
+                collection_name=COLLECTION_NAME,
+                points=points,
+                wait=wait
+            )
+            total_points += len(points.ids)
+
+        pending_upsert.result()
+
+    _remember_uploaded_files(chunks)
+
+    logger.info(f"Загружено {total_points} чанков в Qdrant")
+    return total_points
 
-    logger.info(f"Загружено {len(points)} чанков в Qdrant")
-    return len(points)
+
+# Сколько пакетов одновременно считается и загружается в async_add_chunks
+UPSERT_CONCURRENCY = 4
+
+
+async def async_add_chunks(
+    chunks: List[Dict[str, Any]],
+    model: str = OLLAMA_MODEL,
+    wait: bool = False
+) -> int:
+    """
+    Асинхронный вариант add_chunks_to_qdrant: пакеты по EMBED_BATCH_SIZE чанков
+    считаются и загружаются параллельно, но не более UPSERT_CONCURRENCY одновременно.
+    Вызывается из синхронного кода через run_async(...).
+    Возвращает количество добавленных точек.
+    """
+    if not chunks:
+        logger.info("Нет чанков для загрузки в Qdrant")
+        return 0
+
+    semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
+    async_client = get_async_client()
+
+    async def upsert_batch(batch: List[Dict[str, Any]]) -> int:
+        async with semaphore:
+            # Ollama вызывается через requests, поэтому embeddings считаются в потоке
+            points = await asyncio.to_thread(create_embeddings_from_chunks, batch, model)
+            await async_client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=points,
+                wait=wait
+            )
+            return len(points.ids)
+
+    counts = await asyncio.gather(*[
+        upsert_batch(chunks[start:start + EMBED_BATCH_SIZE])
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE)
+    ])
+
+    _remember_uploaded_files(chunks)
+
+    total_points = sum(counts)
+    logger.info(f"Загружено {total_points} чанков в Qdrant")
+    return total_points
+
+
+def _remember_uploaded_files(chunks: List[Dict[str, Any]]) -> None:
+    """Загруженные файлы теперь существуют в коллекции — обновляем кэш проверки дубликатов"""
+    for file_name in {(chunk.get("metadata") or {}).get("file_name") for chunk in chunks}:
+        if file_name:
+            _remember_file_name(file_name.lower(), True)
+
+
+# Поиск по квантованным векторам с уточнением score по оригинальным
+SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True)
+)
+
+# Поля payload, которые отдаются в результатах поиска
+SEARCH_PAYLOAD_FIELDS = [
+    "text",
+    "word_count",
+    "char_count",
+    "metadata",
+    "business_metadata",
+]
+
+# Кэш результатов поиска: (запрос, top_k, модель) → (результаты, время поиска).
+# Новые чанки загружают воркеры Celery в других процессах, поэтому сбросить кэш
+# при загрузке нельзя — устаревание ограничено SEARCH_CACHE_TTL секундами.
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 300
+_search_cache: "OrderedDict[Tuple[str, int, str], Tuple[List[Dict[str, Any]], float]]" = OrderedDict()
+# Поиск вызывается из потоков asyncio.to_thread, а OrderedDict не потокобезопасен
+_search_cache_lock = threading.Lock()
+
+
+def _remember_search(key: Tuple[str, int, str], results: List[Dict[str, Any]]) -> None:
+    with _search_cache_lock:
+        _search_cache[key] = (results, time.monotonic())
+        _search_cache.move_to_end(key)
+        if len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
 
 
 def reserch_similar_chunks(
@@ -156,17 +501,29 @@ def reserch_similar_chunks(
 ) -> List[Dict[str, Any]]:
     """
     Поиск похожих чанков.
+    Повторный запрос в пределах SEARCH_CACHE_TTL отдаётся из кэша без обращения к Ollama и Qdrant.
     """
-    query_embedding = get_embedding(query, model)
-
-    search_result = client.search(
+    key = (query.strip(), top_k, model)
+    with _search_cache_lock:
+        cached = _search_cache.get(key)
+        if cached is not None:
+            results, searched_at = cached
+            if time.monotonic() - searched_at < SEARCH_CACHE_TTL:
+                _search_cache.move_to_end(key)
+                return list(results)
+
+    query_embedding = list(_get_query_embedding(key[0], model))
+
+    search_result = get_client().query_points(
         collection_name=COLLECTION_NAME,
-        query_vector=query_embedding,
+        query=query_embedding,
         limit=top_k,
-        with_payload=True
-    )
+        search_params=SEARCH_PARAMS,
+        with_payload=models.PayloadSelectorInclude(include=SEARCH_PAYLOAD_FIELDS),
+        with_vectors=False
+    ).points
 
-    return [
+    results = [
         {
             "id": point.id,
             "score": point.score,
@@ -178,6 +535,25 @@ def reserch_similar_chunks(
         }
         for point in search_result
     ]
+    _remember_search(key, results)
+    return list(results)
+
+
+# Кэш проверки дубликатов по имени файла: имя → (найден, время проверки).
+# Найденные имена хранятся до вытеснения, промахи — не дольше FILE_NAME_MISS_TTL секунд,
+# так как файл может загрузить другой процесс воркера.
+FILE_NAME_CACHE_SIZE = 4096
+FILE_NAME_MISS_TTL = 300
+_file_name_cache: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+_file_name_cache_lock = threading.Lock()
+
+
+def _remember_file_name(normalized_name: str, found: bool) -> None:
+    with _file_name_cache_lock:
+        _file_name_cache[normalized_name] = (found, time.monotonic())
+        _file_name_cache.move_to_end(normalized_name)
+        if len(_file_name_cache) > FILE_NAME_CACHE_SIZE:
+            _file_name_cache.popitem(last=False)
 
 
 def reserch_file_name(
@@ -186,9 +562,17 @@ def reserch_file_name(
     """
     Поиск идентичных чанков по названию.
     """
+    normalized_name = query_file_name.lower()
+
+    with _file_name_cache_lock:
+        cached = _file_name_cache.get(normalized_name)
+    if cached is not None:
+        found, checked_at = cached
+        if found or time.monotonic() - checked_at < FILE_NAME_MISS_TTL:
+            return found
+
     try:
-        normalized_name = query_file_name.lower()
-        search_result = client.scroll(
+        search_result = get_client().scroll(
             collection_name=COLLECTION_NAME,
             scroll_filter=models.Filter(
                 must=[models.FieldCondition(
@@ -204,7 +588,9 @@ def reserch_file_name(
 
         points, _ = search_result
 
-        return len(points) > 0
+        found = len(points) > 0
+        _remember_file_name(normalized_name, found)
+        return found
     except Exception as e:
         logger.info(f"Ошибка при поиске чанков: {e}")
         return False
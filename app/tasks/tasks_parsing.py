@@ -1,13 +1,39 @@
+import os
+import json
 import shutil
-from celery import Celery
+import time
+from celery import Celery, chord
+from celery import states as celery_states
 from celery.signals import worker_process_init
 from pathlib import Path
 from celery.exceptions import ImproperlyConfigured
 from app.core.chanking import TextSplitter, DocumentChunker, BusinessMetadata
-from app.core.parsers_system import ParserManager
+from app.core.parsers_system import ParserManager, FileValidator
 from app.config import REDIS_URL
-from app.database import init_qdrant, add_chunks_to_qdrant, reserch_file_name
-SUPPORTED_EXTENSIONS = {'.txt','.pdf','.docx','.doc','.xlsx','.xls','.dxf','.dwg'}
+from app.database import (
+    init_qdrant,
+    add_chunks_to_qdrant,
+    async_add_chunks,
+    run_async,
+    reserch_file_name
+)
+SUPPORTED_EXTENSIONS = frozenset({'.txt','.pdf','.docx','.doc','.xlsx','.xls','.dxf','.dwg'})
+# Итоговая задача пакета загружает в Qdrant чанки всей папки, поэтому ей нужен больший
+# лимит времени, чем у задач по одному файлу; он меньше visibility_timeout брокера,
+# иначе незавершённая задача была бы выдана повторно
+BATCH_FINALIZE_SOFT_TIME_LIMIT = 3300
+BATCH_FINALIZE_TIME_LIMIT = 3400
+# Срок хранения результатов в Redis. Он же задаёт срок жизни ключей объединения chord
+# (chord-unlock, счётчики .j/.t) и состояния пакета, поэтому должен покрывать весь пакет:
+# ожидание в очереди, разбор файлов и итоговую задачу. Иначе ключи истекут до конца
+# разбора, finalize_batch не будет вызван и каталог чанков пакета останется на диске
+RESULT_EXPIRES = 4 * 3600
+# Сколько чанков из разных файлов пакетная задача копит перед одной загрузкой в Qdrant
+QDRANT_UPSERT_BATCH = 128
+# Как долго результат проверки отмены задачи считается актуальным, сек
+REVOKE_CHECK_TTL = 0.5
+# Минимальный интервал между записями прогресса с тем же процентом, сек
+PROGRESS_MIN_INTERVAL = 0.5
 import logging
 logger = logging.getLogger(__name__)
 celery_app = Celery(
@@ -17,16 +43,23 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    result_expires=3600,
+    result_expires=RESULT_EXPIRES,
     task_track_started=True,
     task_soft_time_limit=300,
     task_time_limit=360,
     
     task_acks_late=True,
-    worker_prefetch_multiplier=1,
+    # Задачи смешивают парсинг (CPU) и ожидание Qdrant/Ollama (I/O): с запасом в одну
+    # задачу процесс пула не простаивает между ними
+    worker_prefetch_multiplier=int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', '2')),
     task_reject_on_worker_lost=True,
     
     worker_max_tasks_per_child=50,
+
+    # Ход обработки пишется через logger, а не print: формат задаётся здесь один раз,
+    # пошаговые сообщения идут на уровне DEBUG и отключаются в рабочем режиме
+    worker_log_format='[%(asctime)s: %(levelname)s/%(processName)s] %(message)s',
+    worker_task_log_format='[%(asctime)s: %(levelname)s/%(processName)s] %(task_name)s[%(task_id)s]: %(message)s',
     
     broker_transport_options={
         'visibility_timeout': 3600,
@@ -39,55 +72,238 @@ celery_app.conf.update(
     },
 )
 
+# Менеджер парсеров, сплиттер и бизнес-метаданные живут всё время процесса воркера,
+# чтобы не создавать их заново в каждой задаче
+parser_manager: ParserManager = None
+text_splitter: TextSplitter = None
+business_metadata: BusinessMetadata = None
+
+
+def _get_parser_manager() -> ParserManager:
+    """Возвращает менеджер парсеров текущего процесса, создавая его при первом обращении"""
+    global parser_manager
+    if parser_manager is None:
+        parser_manager = ParserManager()
+    return parser_manager
+
+
+def _get_text_splitter() -> TextSplitter:
+    """Возвращает сплиттер текущего процесса, создавая его при первом обращении"""
+    global text_splitter
+    if text_splitter is None:
+        text_splitter = TextSplitter()
+    return text_splitter
+
+
+def _get_business_metadata() -> BusinessMetadata:
+    """Возвращает бизнес-метаданные текущего процесса (только для чтения)"""
+    global business_metadata
+    if business_metadata is None:
+        business_metadata = BusinessMetadata()
+    return business_metadata
+
+
 @worker_process_init.connect
 def init_worker(**_):
     init_qdrant()
+    _get_parser_manager()
+    _get_text_splitter()
+    _get_business_metadata()
+
+
+def _resolve_upload_path(filename: str) -> Path:
+    """Путь к загруженному файлу: имена без префикса uploads считаются относительными к нему"""
+    if filename.startswith("uploads"):
+        return Path(filename)
+    return Path("uploads") / filename
 
 
-def _cleanup_file(filename: str, worker_name: str = "") -> None:
-    """Универсальная функция для удаления файла с логированием"""
+def _cleanup_file(file_path: Path, worker_name: str = "") -> None:
+    """Универсальная функция для удаления файла с логированием; путь уже разрешён вызывающим"""
     try:
-        if filename.startswith("uploads") or filename.startswith("uploads\\"):
-            file_path = Path(filename)
-        else:
-            file_path = Path("uploads") / filename
-        
-        if file_path.exists():
-            file_path.unlink()
-            logger.info(f"[{worker_name}] Файл удалён: {file_path}")
-            print(f"[{worker_name}] Файл удалён: {file_path}")
-            return True
-        else:
-            logger.warning(f"[{worker_name}] Файл не найден для удаления: {file_path}")
-            return False
+        file_path.unlink()
+        logger.info(f"[{worker_name}] Файл удалён: {file_path}")
+        return True
+    except FileNotFoundError:
+        logger.warning(f"[{worker_name}] Файл не найден для удаления: {file_path}")
+        return False
     except Exception as e:
-        logger.error(f"[{worker_name}] Ошибка удаления файла {filename}: {e}")
-        print(f"[{worker_name}] Ошибка удаления файла: {e}")
+        logger.error(f"[{worker_name}] Ошибка удаления файла {file_path}: {e}")
         return False
 
 
+# Чанки подзадач пакета передаются через файлы рядом с загрузками, а не через result backend:
+# в Redis попадает только путь к файлу. У каждого пакета свой каталог CHUNKS_DIR/<id пакета>;
+# его удаление (при отмене или завершении пакета) означает, что чанки больше никто не заберёт
+CHUNKS_DIR = Path("uploads") / "_chunks"
+# Счётчик завершённых подзадач пакета в Redis: по нему подзадачи сообщают общий прогресс
+BATCH_DONE_KEY_PREFIX = "batch-done-"
+# Срок жизни счётчика продлевается при каждом завершении подзадачи и покрывает
+# жёсткий лимит итоговой задачи: пока пакет жив, счётчик не начнётся заново с 1
+BATCH_DONE_TTL = BATCH_FINALIZE_TIME_LIMIT
+
+
+def batch_chunks_dir(batch_id: str) -> Path:
+    return CHUNKS_DIR / batch_id
+
+
+def batch_done_key(batch_id: str) -> str:
+    return f"{BATCH_DONE_KEY_PREFIX}{batch_id}"
+
+
+def _store_chunks(batch_dir: Path, task_id: str, chunks: list[dict]) -> str:
+    """
+    Сохраняет чанки подзадачи в каталог пакета; возвращает путь к файлу.
+    Каталог не создаётся заново: если пакет отменён, запись завершится FileNotFoundError
+    """
+    chunks_path = batch_dir / f"{task_id}.json"
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    return str(chunks_path)
+
+
+def _load_chunks(chunks_path: str) -> list[dict]:
+    """Читает чанки подзадачи; файл удаляется сразу после чтения"""
+    try:
+        with open(chunks_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        _cleanup_file(Path(chunks_path))
+
+
+def _is_processable(file_path: str) -> bool:
+    """Файл поддерживаемого формата, не пустой и не больше предела - только такие отправляются на обработку"""
+    return FileValidator.validate(file_path, FileValidator.MAX_FILE_SIZE, SUPPORTED_EXTENSIONS, min_size=1)
+
+
+def _report_batch_progress(batch_id: str, folder_name: str, total_files: int) -> None:
+    """Подзадача отмечает завершение своего файла и пишет общий прогресс в состояние пакета"""
+    key = batch_done_key(batch_id)
+    done, _ = celery_app.backend.client.pipeline().incr(key).expire(key, BATCH_DONE_TTL).execute()
+    # Разбор файлов - первые 90%, остальное - загрузка в Qdrant итоговой задачей
+    celery_app.backend.store_result(batch_id, {
+        'current_file': done,
+        'total_files': total_files,
+        'progress': int(done / total_files * 90),
+        'status': f'Обработано файлов {done}/{total_files}',
+        'folder_name': folder_name
+    }, 'PROGRESS')
+
+
+def _upload_top_dirs(file_paths: list[str]) -> set[str]:
+    """Каталоги первого уровня внутри uploads, в которые были сохранены файлы пакета"""
+    top_dirs = set()
+    for file_path in file_paths:
+        try:
+            parts = Path(file_path).relative_to("uploads").parts
+        except ValueError:
+            continue
+        if len(parts) > 1:
+            top_dirs.add(str(Path("uploads") / parts[0]))
+    return top_dirs
+
+
+def _revoke_checker(task_id: str):
+    """Проверка отмены задачи: состояние из Redis читается не чаще раза в REVOKE_CHECK_TTL"""
+    task_result = celery_app.AsyncResult(task_id)
+    last_check = float('-inf')
+    revoked = False
+    
+    def is_revoked() -> bool:
+        nonlocal last_check, revoked
+        now = time.monotonic()
+        if not revoked and now - last_check >= REVOKE_CHECK_TTL:
+            revoked = task_result.state == 'REVOKED'
+            last_check = now
+        return revoked
+    
+    return is_revoked
+
+
+def _progress_reporter(task):
+    """
+    Обёртка над task.update_state для состояния PROGRESS: повторы не пишутся в Redis,
+    а обновления без изменения процента - не чаще раза в PROGRESS_MIN_INTERVAL
+    """
+    last_write = float('-inf')
+    last_meta = {}
+    
+    def report_progress(meta: dict) -> None:
+        nonlocal last_write, last_meta
+        if meta == last_meta:
+            return
+        now = time.monotonic()
+        if meta.get('progress') == last_meta.get('progress') and now - last_write < PROGRESS_MIN_INTERVAL:
+            return
+        task.update_state(state='PROGRESS', meta=meta)
+        last_write = now
+        last_meta = meta
+    
+    return report_progress
+
+
+def _parse_file(manager: ParserManager, file_path: Path, filename: str):
+    """Парсинг файла подходящим парсером; возвращает (расширение, результат парсера)"""
+    ext = manager._parser_extension(str(file_path))
+    
+    parser_class = manager._find_parser_in_registry(ext)
+    if parser_class is None:
+        raise ValueError(f"Парсер для .{ext} не найден")
+    
+    result_parser = manager._ransfer_selected_parser(str(file_path), parser_class)
+    if result_parser is None:
+        raise ValueError(f"Ошибка парсинга файла {filename}")
+    
+    if len(result_parser.text) == 0:
+        raise ValueError(f"Ошибка файл {filename} пустой")
+    
+    return ext, result_parser
+
+
+def _split_text(splitter: TextSplitter, text: str) -> list[str]:
+    """Разбиение текста на чанки; пустой результат считается ошибкой"""
+    chunks = splitter.split_text(text)
+    if not chunks:
+        raise ValueError("Не удалось создать чанки")
+    return chunks
+
+
+def _build_chunks(manager: ParserManager, chunks: list[str], parser_metadata: dict,
+                  file_path: Path, ext: str, data_metadata: BusinessMetadata) -> list[dict]:
+    """Объединение чанков с метаданными для загрузки в Qdrant"""
+    metaDocument = DocumentChunker(chunks)
+    return metaDocument.uniter(
+        parser_metadata,
+        str(file_path),
+        manager._file_name(str(file_path)),
+        ext,
+        data_metadata
+    )
+
+
 @celery_app.task(bind=True)
-def generate_embedding(self, filename: str, onlyfile: bool = False):
+def generate_embedding(self, filename: str):
     """Обработка файла с отслеживанием прогресса"""
     
     worker_name = self.request.hostname
-    filenames = Path(filename)
+    file_path = _resolve_upload_path(filename)
     task_id = self.request.id
     # file_paths = None
 
-    task_result = celery_app.AsyncResult(task_id)
-    if task_result.state == 'REVOKED':
-        print(f"[{worker_name}] Задача {task_id} отменена пользователем")
-        _cleanup_file(filename, worker_name)
+    is_revoked = _revoke_checker(task_id)
+    report_progress = _progress_reporter(self)
+    if is_revoked():
+        logger.info(f"[{worker_name}] Задача {task_id} отменена пользователем")
+        _cleanup_file(file_path, worker_name)
         return {
             "status": "cancelled",
             "message": "Задача отменена пользователем",
             "filename": filename
         }
 
-    ext = filenames.suffix.lower()
+    ext = os.path.splitext(filename)[1].lower()
     if ext not in SUPPORTED_EXTENSIONS:
-        _cleanup_file(filename, worker_name)
+        _cleanup_file(file_path, worker_name)
         return {
             "status": "skipped",
             "reason": "unsupported_format",
@@ -96,28 +312,23 @@ def generate_embedding(self, filename: str, onlyfile: bool = False):
         }
 
     try:
-        dispach = filename
-        if onlyfile:
-            parts = filename.split('\\')
-            dispach = '\\'.join(parts[2:]) if len(parts) > 2 else filename
-
-        print(f"[{worker_name}] Проверка файла {dispach or filename} на дубликаты")
-
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'current_step': 1,
-                'total_steps': 6,
-                'progress': 0,
-                'status': 'Сопоставление файла...',
-                'filename': dispach or filename
-            }
-        )
+        # Имя для поиска дубликатов нормализуется так же, как metadata.file_name в чанках
+        dispach = _get_parser_manager()._file_name(filename)
+
+        logger.debug(f"[{worker_name}] Проверка файла {dispach or filename} на дубликаты")
+
+        report_progress({
+            'current_step': 1,
+            'total_steps': 6,
+            'progress': 0,
+            'status': 'Сопоставление файла...',
+            'filename': dispach or filename
+        })
         
         if reserch_file_name(dispach or filename):
             logger.info(f"[{worker_name}] Файл {dispach or filename} уже существует в базе данных")
 
-            _cleanup_file(filename, worker_name)
+            _cleanup_file(file_path, worker_name)
             
             return {
                 "status": "skipped",
@@ -127,128 +338,84 @@ def generate_embedding(self, filename: str, onlyfile: bool = False):
             }
 
 
-        print(f"[{worker_name}] Начинаю обработку файла: {dispach or filename}")
-        
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'current_step': 2,
-                'total_steps': 6,
-                'progress': 15,
-                'status': 'Чтение файла...',
-                'filename': dispach or filename
-            }
-        )
+        logger.info(f"[{worker_name}] Начинаю обработку файла: {dispach or filename}")
         
-        if filename.startswith("uploads") or filename.startswith("uploads\\"):
-            file_path = Path(filename)
-        else:
-            file_path = Path("uploads") / filename
+        report_progress({
+            'current_step': 2,
+            'total_steps': 6,
+            'progress': 15,
+            'status': 'Чтение файла...',
+            'filename': dispach or filename
+        })
         
         if not file_path.exists():
             raise FileNotFoundError(f"Файл {filename} не найден")
         
-        print(f"[{worker_name}] Файл найден: {file_path.resolve()}")
+        logger.debug(f"[{worker_name}] Файл найден: {file_path}")
         
-        manager = ParserManager()
-        splitter = TextSplitter()
-        data_metadata = BusinessMetadata()
+        manager = _get_parser_manager()
+        splitter = _get_text_splitter()
+        data_metadata = _get_business_metadata()
         
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'current_step': 3,
-                'total_steps': 6,
-                'progress': 30,
-                'status': 'Парсинг файла...',
-                'filename': filename
-            }
-        )
-        
-        ext = manager._parser_extension(str(file_path))
-        print(f"[{worker_name}] Расширение: {ext}")
-        
-        parser_class = manager._find_parser_in_registry(ext)
-        if parser_class is None:
-            raise ValueError(f"Парсер для .{ext} не найден")
-        
-        result_parser = manager._ransfer_selected_parser(str(file_path), parser_class)
-        if result_parser is None:
-            raise ValueError(f"Ошибка парсинга файла {filename}")
+        report_progress({
+            'current_step': 3,
+            'total_steps': 6,
+            'progress': 30,
+            'status': 'Парсинг файла...',
+            'filename': filename
+        })
         
-        if len(result_parser.text) == 0:
-            raise ValueError(f"Ошибка файл {filename} пустой")
+        ext, result_parser = _parse_file(manager, file_path, filename)
+        logger.debug(f"[{worker_name}] Расширение: {ext}")
         
         text_length = len(result_parser.text)
-        print(f"[{worker_name}] Парсинг завершен: {text_length} символов")
+        logger.debug(f"[{worker_name}] Парсинг завершен: {text_length} символов")
 
-        task_result = celery_app.AsyncResult(task_id)
-        if task_result.state == 'REVOKED':
-            _cleanup_file(filename, worker_name)
+        if is_revoked():
+            _cleanup_file(file_path, worker_name)
             return {"status": "cancelled"}
         
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'current_step': 4,
-                'total_steps': 6,
-                'progress': 45,
-                'status': 'Разбиение на чанки...',
-                'filename': filename
-            }
-        )
+        report_progress({
+            'current_step': 4,
+            'total_steps': 6,
+            'progress': 45,
+            'status': 'Разбиение на чанки...',
+            'filename': filename
+        })
         
-        chunks = splitter.split_text(result_parser.text)
+        chunks = _split_text(splitter, result_parser.text)
         chunks_count = len(chunks)
         
-        if chunks_count == 0:
-            raise ValueError("Не удалось создать чанки")
-            
-        
-        print(f"[{worker_name}] Создано чанков: {chunks_count}")
+        logger.debug(f"[{worker_name}] Создано чанков: {chunks_count}")
 
-        task_result = celery_app.AsyncResult(task_id)
-        if task_result.state == 'REVOKED':
-            _cleanup_file(filename, worker_name)
+        if is_revoked():
+            _cleanup_file(file_path, worker_name)
             return {"status": "cancelled"}
 
         
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'current_step': 5,
-                'total_steps': 6,
-                'progress': 60,
-                'status': 'Создание метаданных...',
-                'filename': filename
-            }
-        )
+        report_progress({
+            'current_step': 5,
+            'total_steps': 6,
+            'progress': 60,
+            'status': 'Создание метаданных...',
+            'filename': filename
+        })
         
-        metaDocument = DocumentChunker(chunks)
-        result_uniter = metaDocument.uniter(
-            result_parser.metadata,
-            str(file_path),
-            manager._file_name(str(file_path)),
-            ext,
-            data_metadata
-        )
-        print(f"[{worker_name}] Метаданные созданы")
+        result_uniter = _build_chunks(manager, chunks, result_parser.metadata, file_path, ext, data_metadata)
+        logger.debug(f"[{worker_name}] Метаданные созданы")
         
-        self.update_state(
-            state='PROGRESS',
-            meta={
-                'current_step': 6,
-                'total_steps': 6,
-                'progress': 80,
-                'status': 'Сохранение в Qdrant...',
-                'filename': filename
-            }
-        )
+        report_progress({
+            'current_step': 6,
+            'total_steps': 6,
+            'progress': 80,
+            'status': 'Сохранение в Qdrant...',
+            'filename': filename
+        })
         logger.info(f"Колличество чанков на загрузку {len(result_uniter)}")
-        points = add_chunks_to_qdrant(result_uniter)
-        print(f"[{worker_name}] Добавлено точек в Qdrant: {points}")
+        points = run_async(async_add_chunks(result_uniter))
+        logger.info(f"[{worker_name}] Добавлено точек в Qdrant: {points}")
         
-        _cleanup_file(filename, worker_name)
+        _cleanup_file(file_path, worker_name)
         
         result = {
             "status": "success",
@@ -259,35 +426,151 @@ def generate_embedding(self, filename: str, onlyfile: bool = False):
             "points_added": points
         }
         
-        print(f"[{worker_name}] Файл {filename} успешно обработан!")
+        logger.info(f"[{worker_name}] Файл {filename} успешно обработан!")
 
         return result
         
     except FileNotFoundError as e:
         error_msg = str(e)
-        print(f"[{worker_name}] Файл не найден: {error_msg}")
+        logger.error(f"[{worker_name}] Файл не найден: {error_msg}")
         raise
         
     except ValueError as e:
         error_msg = str(e)
-        print(f"[{worker_name}] Ошибка: {error_msg}")
+        logger.error(f"[{worker_name}] Ошибка: {error_msg}")
         raise
         
     except Exception as e:
         error_msg = f"Неожиданная ошибка: {str(e)}"
-        print(f"[{worker_name}] {error_msg}")
+        logger.error(f"[{worker_name}] {error_msg}")
         
-        _cleanup_file(filename, worker_name)
+        _cleanup_file(file_path, worker_name)
         raise
 
 
 @celery_app.task(bind=True)
-def generate_embedding_batch(self, file_paths: list[str], folder_name: str = ""):
-    """Обработка нескольких файлов из папки с общим отслеживанием прогресса
+def parse_and_chunk(self, filename: str, batch_id: str, folder_name: str, total_files: int) -> dict:
+    """
+    Парсинг и разбиение файла пакета без загрузки в Qdrant; чанки забирает finalize_batch.
+    Ошибка файла возвращается в результате, а не исключением: иначе chord не вызовет
+    итоговую задачу и остальные файлы пакета не будут загружены
+    """
+    
+    worker_name = self.request.hostname
+    file_path = _resolve_upload_path(filename)
+    batch_dir = batch_chunks_dir(batch_id)
+    dispach = _get_parser_manager()._file_name(filename)
+    
+    try:
+        if not batch_dir.is_dir():
+            logger.info(f"[{worker_name}] Пакет {batch_id} отменён, файл {filename} пропущен")
+            return {"status": "cancelled", "file_name": filename}
+        
+        if os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+            return {"status": "skipped", "reason": "unsupported_format", "file_name": filename}
+        
+        if reserch_file_name(dispach):
+            logger.info(f"[{worker_name}] Файл {dispach} уже существует в базе данных")
+            return {"status": "skipped", "reason": "already_exists", "file_name": dispach}
+        
+        if not file_path.exists():
+            raise FileNotFoundError(f"Файл {filename} не найден")
+        
+        manager = _get_parser_manager()
+        ext, result_parser = _parse_file(manager, file_path, filename)
+        chunks = _split_text(_get_text_splitter(), result_parser.text)
+        result_uniter = _build_chunks(manager, chunks, result_parser.metadata, file_path, ext, _get_business_metadata())
+        
+        logger.info(f"[{worker_name}] {dispach}: создано чанков {len(result_uniter)}")
+        
+        return {
+            "status": "success",
+            "filename": filename,
+            "text_length": len(result_parser.text),
+            "chunks_count": len(result_uniter),
+            "chunks_path": _store_chunks(batch_dir, self.request.id, result_uniter)
+        }
+    except Exception as e:
+        logger.error(f"[{worker_name}] Ошибка обработки {filename}: {e}")
+        return {"status": "error", "file_name": filename, "error": str(e)}
+    finally:
+        _cleanup_file(file_path, worker_name)
+        if batch_dir.is_dir():
+            _report_batch_progress(batch_id, folder_name, total_files)
+
+
+@celery_app.task(bind=True)
+def generate_embedding_batch(self, folder_name: str, saved_paths: list[str]):
+    """Обработка всех файлов папки с общим отслеживанием прогресса
+    
+    Задача только ставит файлы в обработку и заменяет себя на chord: подзадачи
+    parse_and_chunk разбирают файлы на всех воркерах пула, а finalize_batch получает
+    их результаты и загружает чанки в Qdrant. Итоговая задача наследует id пакета,
+    поэтому клиент следит за одним id до конца обработки. Пакет не ждёт подзадачи
+    внутри воркера и не занимает процесс пула на всё время обработки папки.
     
     Args:
-        file_paths: Список относительных путей к файлам
-        folder_name: Название папки для отображения в логах
+        folder_name: Название папки для отчёта о ходе обработки
+        saved_paths: Пути (внутри uploads), по которым эндпоинт сохранил файлы папки;
+            неподдерживаемые форматы и пустые файлы не отправляются на обработку и сразу удаляются
+    """
+    
+    worker_name = self.request.hostname
+    batch_id = self.request.id
+    
+    file_paths = []
+    for saved_path in saved_paths:
+        # Неподдерживаемые и пустые файлы отсекаются до постановки задач
+        if _is_processable(saved_path):
+            file_paths.append(saved_path)
+        else:
+            _cleanup_file(Path(saved_path), worker_name)
+    total_files = len(file_paths)
+    
+    logger.info(f"[{worker_name}] Начинаю пакетную обработку: {total_files} файлов")
+    skipped_files = len(saved_paths) - total_files
+    if skipped_files:
+        logger.info(f"[{worker_name}] Пропущено файлов (неподдерживаемый формат или пустые): {skipped_files}")
+    
+    if not file_paths:
+        for top_dir in _upload_top_dirs(saved_paths):
+            cleanup_folder.apply_async(args=[top_dir], priority=9)
+        return {
+            "status": "completed",
+            "folder_name": folder_name,
+            "worker": worker_name,
+            "total_files": 0,
+            "processed": 0,
+            "points_added": 0,
+            "errors_count": 0,
+            "results": [],
+            "errors": []
+        }
+    
+    batch_chunks_dir(batch_id).mkdir(parents=True, exist_ok=True)
+    self.update_state(state='PROGRESS', meta={
+        'current_file': 0,
+        'total_files': total_files,
+        'progress': 0,
+        'status': f'Обработано файлов 0/{total_files}',
+        'folder_name': folder_name
+    })
+    
+    header = [parse_and_chunk.s(file_path, batch_id, folder_name, total_files) for file_path in file_paths]
+    # Если итоговая задача упадёт, не дойдя до своей очистки (например, по жёсткому лимиту
+    # времени), каталог чанков пакета удаляется обработчиком ошибки
+    callback = finalize_batch.s(folder_name, file_paths, saved_paths).on_error(
+        cleanup_folder.si(str(batch_chunks_dir(batch_id)))
+    )
+    raise self.replace(chord(header, callback))
+
+
+@celery_app.task(bind=True, soft_time_limit=BATCH_FINALIZE_SOFT_TIME_LIMIT, time_limit=BATCH_FINALIZE_TIME_LIMIT)
+def finalize_batch(self, child_results: list[dict], folder_name: str, file_paths: list[str], saved_paths: list[str]):
+    """
+    Итог пакета: чанки подзадач загружаются в Qdrant общими пакетами по QDRANT_UPSERT_BATCH.
+    Файл считается обработанным только после успешной загрузки пакета с его чанками;
+    ошибка загрузки относится ко всем файлам этого пакета
     """
     
     worker_name = self.request.hostname
@@ -295,104 +578,124 @@ def generate_embedding_batch(self, file_paths: list[str], folder_name: str = "")
     processed_files = 0
     results = []
     errors = []
+    pending_points = []
+    # Файлы, чьи чанки лежат в pending_points: (имя, путь, число чанков)
+    pending_files = []
+    points_added = 0
+    report_progress = _progress_reporter(self)
+    
+    def flush() -> None:
+        nonlocal pending_points, pending_files, points_added, processed_files
+        if not pending_files:
+            return
+        try:
+            points_added += add_chunks_to_qdrant(pending_points)
+        except Exception as e:
+            logger.error(f"[{worker_name}] Ошибка загрузки в Qdrant ({len(pending_files)} файлов): {e}")
+            for filename, file_path_str, _ in pending_files:
+                errors.append({
+                    'filename': filename,
+                    'file_path': file_path_str,
+                    'error': f"Ошибка загрузки в Qdrant: {str(e)}"
+                })
+        else:
+            for filename, file_path_str, chunks_count in pending_files:
+                processed_files += 1
+                # В результат пакета попадают только счётчики, без текста и чанков
+                results.append({
+                    'filename': filename,
+                    'file_path': file_path_str,
+                    'result': {
+                        'status': 'success',
+                        'chunks_count': chunks_count,
+                        'points_added': chunks_count
+                    },
+                })
+        pending_points = []
+        pending_files = []
     
     try:
-        print(f"[{worker_name}] Начинаю пакетную обработку: {total_files} файлов")
-        
-        for idx, file_path_str in enumerate(file_paths, 1):
-            file_path = Path(file_path_str)
-            filename = file_path.name
+        for idx, (file_path_str, task_result) in enumerate(zip(file_paths, child_results), 1):
+            filename = Path(file_path_str).name
+            status = task_result.get('status')
             
             try:
-                progress = int((idx - 1) / total_files * 100)
-                
-                self.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'current_file': idx,
-                        'total_files': total_files,
-                        'progress': progress,
-                        'status': f'Обработка файла {idx}/{total_files}: {filename}',
-                        'folder_name': folder_name,
-                        'processed': processed_files,
-                        'errors': len(errors)
-                    }
-                )
-                
-                print(f"[{worker_name}] [{idx}/{total_files}] Обработка: {file_path}")
-                
-                result = generate_embedding.apply(args=[str(file_path_str), True])
-                print(f"Task ID: {result.id}")
-                print(f"Status: {result.status}")
-                if result.successful():
-                    task_result = result.result
-                    if isinstance(task_result, dict) and task_result.get('status') == 'skipped':
-                        print(f"Пропущен (дубликат): {filename}")
-                        results.append({
-                            'filename': filename,
-                            'file_path': file_path_str,
-                            'result': task_result['status'],
-                        })
-                    else:
-                        processed_files += 1
-                        results.append({
-                            'filename': filename,
-                            'file_path': file_path_str,
-                            'result': result.result,
-                        })
-                        print(f"[{worker_name}] [{idx}/{total_files}] Успешно: {filename}")
+                if status == 'success':
+                    chunks = _load_chunks(task_result['chunks_path'])
+                    pending_points.extend(chunks)
+                    pending_files.append((filename, file_path_str, len(chunks)))
+                    logger.debug(f"[{worker_name}] [{idx}/{total_files}] Разобран: {filename}")
+                elif status in ('skipped', 'cancelled'):
+                    logger.debug(f"Пропущен ({task_result.get('reason', status)}): {filename}")
+                    results.append({
+                        'filename': filename,
+                        'file_path': file_path_str,
+                        'result': status,
+                    })
                 else:
                     errors.append({
                         'filename': filename,
                         'file_path': file_path_str,
-                        'error': str(result.result)
+                        'error': task_result.get('error', 'Unknown error')
                     })
-                    print(f"[{worker_name}] [{idx}/{total_files}] Ошибка: {filename}")
+                    logger.warning(f"[{worker_name}] [{idx}/{total_files}] Ошибка: {filename}")
                     
             except Exception as e:
                 error_msg = f"Ошибка обработки {filename}: {str(e)}"
-                print(f"[{worker_name}] {error_msg}")
+                logger.error(f"[{worker_name}] {error_msg}")
                 errors.append({
                     'filename': filename,
                     'file_path': file_path_str,
                     'error': error_msg
                 })
-        
-        final_result = {
-            "status": "completed",
-            "folder_name": folder_name,
-            "worker": worker_name,
-            "total_files": total_files,
-            "processed": processed_files,
-            "errors_count": len(errors),
-            "results": results,
-            "errors": errors
-        }
-        
-        print(f"[{worker_name}] Пакетная обработка завершена: {processed_files}/{total_files} успешно")
-
-        if folder_name:
-            uploads_dir = Path("uploads")
-            folder_path = uploads_dir / folder_name
-
-            if folder_path.exists() and folder_path.is_dir():
-                shutil.rmtree(folder_path)
-                print(f"[{worker_name}] Папка {folder_path} удалена")
-
-        self.update_state(
-            state='SUCCESS',
-            meta={
-                'status': 'completed',
-                'batch_results': results,
-                'batch_errors': errors,
+            
+            if len(pending_points) >= QDRANT_UPSERT_BATCH:
+                flush()
+            
+            report_progress({
+                'current_file': idx,
+                'total_files': total_files,
+                'progress': 90 + int(idx / total_files * 10),
+                'status': f'Сохранение в Qdrant {idx}/{total_files}',
+                'folder_name': folder_name,
                 'processed': processed_files,
-                'total_files': total_files
-            }
-        )
-
-        return final_result
+                'errors': len(errors)
+            })
         
-    except Exception as e:
-        error_msg = f"Критическая ошибка пакетной обработки: {str(e)}"
-        print(f"[{worker_name}] {error_msg}")
-        raise
\ No newline at end of file
+        flush()
+    finally:
+        # Чанки, не загруженные из-за прерывания, больше никому не нужны
+        shutil.rmtree(batch_chunks_dir(self.request.id), ignore_errors=True)
+        # Все подзадачи завершены: счётчик прогресса пакета больше не нужен
+        try:
+            celery_app.backend.client.delete(batch_done_key(self.request.id))
+        except Exception as e:
+            logger.warning(f"[{worker_name}] Не удалось удалить счётчик пакета: {e}")
+        # Файлы удаляют подзадачи; оставшиеся пустые каталоги загрузки удаляются
+        # отдельной задачей, чтобы не задерживать результат
+        for top_dir in _upload_top_dirs(saved_paths):
+            cleanup_folder.apply_async(args=[top_dir], priority=9)
+            logger.info(f"[{worker_name}] Папка {top_dir} передана на удаление")
+    
+    final_result = {
+        "status": "completed",
+        "folder_name": folder_name,
+        "worker": worker_name,
+        "total_files": total_files,
+        "processed": processed_files,
+        "points_added": points_added,
+        "errors_count": len(errors),
+        "results": results,
+        "errors": errors
+    }
+    
+    logger.info(f"[{worker_name}] Пакетная обработка завершена: {processed_files}/{total_files} успешно")
+    
+    return final_result
+
+
+@celery_app.task(name='cleanup_folder', ignore_result=True)
+def cleanup_folder(path: str) -> None:
+    """Фоновое удаление папки загрузки после пакетной обработки"""
+    shutil.rmtree(path, ignore_errors=True)
+    logger.info(f"Папка {path} удалена")
@@ -5,6 +5,63 @@
 
 import redis
 import sys
+from itertools import islice
+
+# Ключи перебираются через SCAN (не блокирует Redis, в отличие от KEYS)
+# и удаляются пачками через UNLINK в пайплайне: память освобождается в фоне
+SCAN_COUNT = 5000
+UNLINK_BATCH = 1000
+
+
+def _batches(keys, size=UNLINK_BATCH):
+    """Разбивает поток ключей на списки по size штук"""
+    keys = iter(keys)
+    while True:
+        batch = list(islice(keys, size))
+        if not batch:
+            return
+        yield batch
+
+
+def unlink_keys(r, keys):
+    """Удаляет ключи пачками через пайплайн UNLINK, возвращает количество удалённых"""
+    deleted = 0
+    for batch in _batches(keys):
+        pipe = r.pipeline(transaction=False)
+        pipe.unlink(*batch)
+        deleted += sum(pipe.execute())
+    return deleted
+
+
+def find_broken_keys(r):
+    """Ищет ключи с битыми данными Celery; TYPE и GET отправляются пайплайном по пачкам SCAN"""
+    for batch in _batches(r.scan_iter(count=SCAN_COUNT)):
+        pipe = r.pipeline(transaction=False)
+        for key in batch:
+            pipe.type(key)
+        key_types = pipe.execute(raise_on_error=False)
+        
+        string_keys = []
+        for key, key_type in zip(batch, key_types):
+            if isinstance(key_type, Exception):
+                # Любая ошибка - удаляем ключ
+                yield key
+            elif key_type == b'string':
+                string_keys.append(key)
+        
+        if not string_keys:
+            continue
+        
+        pipe = r.pipeline(transaction=False)
+        for key in string_keys:
+            pipe.get(key)
+        values = pipe.execute(raise_on_error=False)
+        
+        for key, value in zip(string_keys, values):
+            # Если не можем прочитать - удаляем; иначе проверяем на битые Celery данные
+            if isinstance(value, Exception) or (value and (b'exc_type' in value or b'celery' in value.lower())):
+                yield key
+
 
 def aggressive_cleanup():
     """Полная очистка всех ключей Celery"""
@@ -29,47 +86,16 @@ def aggressive_cleanup():
         
         for pattern in patterns:
             try:
-                keys = r.keys(pattern)
-                if keys:
-                    print(f"   Найдено {len(keys)} ключей по шаблону: {pattern.decode('utf-8', errors='ignore')}")
-                    for key in keys:
-                        try:
-                            r.delete(key)
-                            total_deleted += 1
-                        except:
-                            pass
+                deleted = unlink_keys(r, r.scan_iter(match=pattern, count=SCAN_COUNT))
+                if deleted:
+                    print(f"   Удалено {deleted} ключей по шаблону: {pattern.decode('utf-8', errors='ignore')}")
+                    total_deleted += deleted
             except Exception as e:
                 print(f"   ⚠️  Ошибка при обработке pattern {pattern}: {e}")
         
         # Дополнительно: удаляем все ключи с битыми данными
         print("\n🔍 Поиск битых данных...")
-        all_keys = r.keys(b'*')
-        broken_keys = 0
-        
-        for key in all_keys:
-            try:
-                # Пытаемся получить тип ключа
-                key_type = r.type(key)
-                
-                # Если это строка, пытаемся прочитать
-                if key_type == b'string':
-                    try:
-                        value = r.get(key)
-                        # Проверяем на битые Celery данные
-                        if value and (b'exc_type' in value or b'celery' in value.lower()):
-                            r.delete(key)
-                            broken_keys += 1
-                    except:
-                        # Если не можем прочитать - удаляем
-                        r.delete(key)
-                        broken_keys += 1
-            except:
-                # Любая ошибка - удаляем ключ
-                try:
-                    r.delete(key)
-                    broken_keys += 1
-                except:
-                    pass
+        broken_keys = unlink_keys(r, find_broken_keys(r))
         
         if broken_keys > 0:
             print(f"   Удалено {broken_keys} битых ключей")
@@ -84,7 +110,7 @@ def aggressive_cleanup():
         
         if remaining > 0:
             print("\n⚠️  В базе остались ключи. Показываю первые 10:")
-            sample_keys = r.keys(b'*')[:10]
+            sample_keys = islice(r.scan_iter(count=SCAN_COUNT), 10)
             for key in sample_keys:
                 key_str = key.decode('utf-8', errors='ignore')
                 print(f"   - {key_str}")
@@ -93,7 +119,7 @@ def aggressive_cleanup():
             response = input().lower().strip()
             
             if response in ['да', 'yes', 'y', 'д']:
-                r.flushdb()
+                r.flushdb(asynchronous=True)
                 print("✅ База полностью очищена!")
         
         print("\n" + "="*60)
@@ -142,7 +168,7 @@ def nuclear_option():
         
         if response == 'УДАЛИТЬ ВСЁ':
             print("\n🗑️  Удаление всех данных...")
-            r.flushdb()
+            r.flushdb(asynchronous=True)
             print("✅ База полностью очищена!")
             print(f"🗑️  Удалено ключей: {keys_before}")
             
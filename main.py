@@ -1,72 +1,165 @@
 from app.core.chanking import TextSplitter, DocumentChunker, BusinessMetadata
-from app.core.parsers_system import ParserManager
-from app.database import client, add_chunks_to_qdrant, reserch_similar_chunks
+from app.core.parsers_system import ParserManager, FileValidator
+from app.database import async_add_chunks, run_async, reserch_similar_chunks
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import logging
 import os
 from pathlib import Path
-def process_all_files_in_folder(folder_path):
+
+logger = logging.getLogger(__name__)
+
+# Объекты процесса-исполнителя: создаются один раз при старте процесса пула
+_manager = None
+_splitter = None
+_extensions = frozenset()
+
+
+def _init_process():
+    global _manager, _splitter, _extensions
+    _manager = ParserManager()
+    _splitter = TextSplitter()
+    # Расширения в формате суффикса ('.pdf'), для которых у менеджера есть парсер
+    _extensions = frozenset(f'.{ext}' for ext in _manager._ext_to_parser)
+
+
+def _parse_and_chunk(file_path: str):
+    """
+    Парсинг и разбиение на чанки одного файла (в процессе пула).
+    Возвращает (чанки, метаданные парсера, расширение, имя файла): между процессами
+    передаются только строки чанков, словари чанков собираются уже в основном процессе
+    """
+    if not FileValidator.validate(file_path, FileValidator.MAX_FILE_SIZE, _extensions, min_size=1):
+        raise ValueError(f"Файл {file_path} не найден, пуст, больше допустимого размера или не поддерживается")
+    
+    # Получаем расширение файла
+    ext = _manager._parser_extension(file_path)
+    
+    # Находим подходящий парсер
+    find = _manager._find_parser_in_registry(ext)
+    
+    # Парсим файл
+    result_parser = _manager._ransfer_selected_parser(file_path, find)
+    
+    # Разбиваем текст на чанки
+    chunks = _splitter.split_text(result_parser.text)
+    
+    return chunks, result_parser.metadata, ext, _manager._file_name(file_path)
+
+
+class ChunkBatcher:
+
     """
-    Обрабатывает все файлы в указанной папке
+    Накопитель чанков нескольких файлов: в Qdrant они уходят общими пакетами, а не по файлу.
+    Ошибка загрузки пакета не пробрасывается, а запоминается в failed для всех файлов,
+    чьи чанки были в этом пакете
+    """
+
+    def __init__(self, flush_threshold: int = 512):
+        self.flush_threshold = flush_threshold
+        self.chunks = []
+        self.files = []
+        self.failed = {}
+        self.total_points = 0
+
+
+    async def extend(self, file_path: str, chunks):
+        if not chunks:
+            return
+        self.chunks.extend(chunks)
+        self.files.append(file_path)
+        if len(self.chunks) >= self.flush_threshold:
+            await self.flush()
+
+
+    async def flush(self) -> int:
+        # Буфер забирается до await: остальные файлы тем временем копят чанки в новый список
+        batch, self.chunks = self.chunks, []
+        files, self.files = self.files, []
+        if not batch:
+            return 0
+        try:
+            points = await async_add_chunks(batch)
+        except Exception as e:
+            logger.error("Ошибка загрузки в Qdrant (файлов: %d): %s", len(files), e)
+            for file_path in files:
+                self.failed[file_path] = e
+            return 0
+        self.total_points += points
+        logger.info("Добавлено точек в Qdrant: %d", points)
+        return points
+
+
+async def _process_one(file_path: str, executor: ProcessPoolExecutor, sem: asyncio.Semaphore,
+                       batcher: ChunkBatcher, data_metadata: BusinessMetadata) -> int:
+    """
+    Конвейер одного файла: парсинг в пуле процессов, затем чанки в общий накопитель
+    """
+    file_name = Path(file_path).name
+    async with sem:
+        logger.debug("Обрабатываю файл: %s", file_name)
+        
+        loop = asyncio.get_running_loop()
+        chunks, parser_metadata, ext, name = await loop.run_in_executor(executor, _parse_and_chunk, file_path)
+        
+        # Создаем метаданные
+        metaDocument = DocumentChunker(chunks)
+        result_uniter = metaDocument.uniter(parser_metadata, file_path, name, ext, data_metadata)
+        logger.debug("%s: получено чанков: %d", file_name, len(result_uniter))
+        
+        await batcher.extend(file_path, result_uniter)
+        return len(result_uniter)
+
+
+async def _process_files(files, max_workers, max_concurrency):
+    sem = asyncio.Semaphore(max_concurrency)
+    batcher = ChunkBatcher()
+    data_metadata = BusinessMetadata()
+    # Клиент Qdrant есть только у основного процесса: процессы пула лишь парсят и режут текст
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_process) as executor:
+        results = await asyncio.gather(
+            *[_process_one(file_path, executor, sem, batcher, data_metadata) for file_path in files],
+            return_exceptions=True
+        )
+    
+    # Остаток, не набравший порога
+    await batcher.flush()
+    logger.info("Всего добавлено точек в Qdrant: %d", batcher.total_points)
+    
+    for file_path, result in zip(files, results):
+        file_name = Path(file_path).name
+        # Чанки файла не попали в Qdrant вместе с пакетом, в котором они были
+        if file_path in batcher.failed:
+            result = batcher.failed[file_path]
+        if isinstance(result, BaseException):
+            logger.error("Ошибка при обработке файла %s: %s", file_name, result, exc_info=result)
+        else:
+            logger.info("Файл %s успешно обработан, чанков: %d", file_name, result)
+
+
+def process_all_files_in_folder(folder_path, max_workers=None, max_concurrency=8):
+    """
+    Обрабатывает все файлы в указанной папке.
+    Файлы идут параллельно (не более max_concurrency одновременно): парсинг и разбиение (CPU)
+    выполняются в пуле процессов, а эмбеддинги и загрузка в Qdrant (I/O) перекрываются
+    между файлами в цикле событий основного процесса
     """
     path = Path(folder_path)
     
     # Проверяем существование папки
     if not path.exists():
-        print(f"Папка {folder_path} не существует")
+        logger.error("Папка %s не существует", folder_path)
         return
     
-    # Инициализируем менеджер один раз
-    manager = ParserManager()
-    splitter = TextSplitter()
-    data_metadata = BusinessMetadata()
+    # Пропускаем папки, обрабатываем только файлы; DirEntry знает тип без лишнего stat
+    with os.scandir(folder_path) as entries:
+        files = [entry.path for entry in entries if entry.is_file(follow_symlinks=False)]
     
-    # Проходим по всем файлам в папке
-    for file_path in path.iterdir():
-        # Пропускаем папки, обрабатываем только файлы
-        if file_path.is_file():
-            try:
-                print(f"\n{'='*50}")
-                print(f"Обрабатываю файл: {file_path.name}")
-                print(f"{'='*50}")
-                
-                # Получаем расширение файла
-                ext = manager._parser_extension(str(file_path))
-                print(f"Расширение файла: {ext}")
-                
-                # Находим подходящий парсер
-                find = manager._find_parser_in_registry(ext)
-                print(f"Найден парсер: {find}")
-                
-                # Парсим файл
-                result_parser = manager._ransfer_selected_parser(str(file_path), find)
-                print(f"Парсинг завершен. Текст: {len(result_parser.text)} символов")
-                
-                # Разбиваем текст на чанки
-                chunks = splitter.split_text(result_parser.text)
-                print(f"Получено чанков: {len(chunks)}")
-                
-                # Создаем метаданные
-                metaDocument = DocumentChunker(chunks)
-                result_uniter = metaDocument.uniter(
-                    result_parser.metadata, 
-                    str(file_path), 
-                    manager._file_name(str(file_path)), 
-                    ext, 
-                    data_metadata
-                )
-                print(f"Метаданные созданы")
-                
-                # Добавляем в Qdrant
-                points = add_chunks_to_qdrant(client, result_uniter)
-                print(f"Добавлено точек в Qdrant: {points}")
-                
-                print(f"✅ Файл {file_path.name} успешно обработан")
-                
-            except Exception as e:
-                print(f"❌ Ошибка при обработке файла {file_path.name}: {str(e)}")
-                continue
+    run_async(_process_files(files, max_workers, max_concurrency))
 
 # Использование
 # if __name__ == "__main__":
+#     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 #     os.environ["HTTP_PROXY"] = ""
 #     os.environ["HTTPS_PROXY"] = ""
 #     # Ваш путь к папке